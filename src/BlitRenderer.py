@@ -0,0 +1,62 @@
+import time
+
+
+class BlitRenderer:
+    """
+    Redraws only the animated artists of a figure on top of a cached background.
+
+    Artists handed to set_artists are marked animated, so a normal draw of the canvas leaves them out; the result
+    of that draw (axes, ticks, legend, data points) is copied as the background. update then restores the
+    background, draws the animated artists and blits the figure, which is much cheaper than a full draw. The
+    background is retaken on every full draw, and thrown away on resize or by invalidate, e.g. after loading new
+    data or when the axes limits change.
+    """
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self._background = None
+        self._artists = []
+        self.frames = 0
+        self.last_frame_time = 0.0
+        self.total_frame_time = 0.0
+        canvas.mpl_connect('draw_event', self._on_draw)
+        canvas.mpl_connect('resize_event', lambda event: self.invalidate())
+
+    def set_artists(self, artists):
+        for artist in self._artists:
+            artist.set_animated(False)
+        self._artists = list(artists)
+        for artist in self._artists:
+            artist.set_animated(True)
+        self.invalidate()
+
+    def invalidate(self):
+        self._background = None
+        self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        figure = self.canvas.figure
+        for artist in self._artists:
+            if artist.figure is figure:
+                figure.draw_artist(artist)
+
+    def update(self):
+        if self._background is None:
+            # the full draw this waits for also draws the artists
+            self.canvas.draw_idle()
+            return
+        start = time.perf_counter()
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.last_frame_time = time.perf_counter() - start
+        self.total_frame_time += self.last_frame_time
+        self.frames += 1
+
+    def stats(self):
+        return {"frames": self.frames, "last_frame_time": self.last_frame_time,
+                "mean_frame_time": self.total_frame_time / self.frames if self.frames else 0.0}
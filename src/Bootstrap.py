@@ -0,0 +1,180 @@
+import functools
+import operator
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+from scipy.integrate import trapezoid
+
+import MoreModels
+
+
+@dataclass
+class BootstrapResult:
+    param_names: list
+    samples: np.ndarray  # (n_samples, n_params) refitted parameter values
+    component_names: list
+    areas: np.ndarray  # (n_samples, n_components) integrated peak areas
+    best_values: dict
+    best_areas: dict
+    converged: bool = False
+    cancelled: bool = False
+    history: list = field(default_factory=list)  # number of samples at each convergence check
+
+    @property
+    def n_samples(self):
+        return self.samples.shape[0]
+
+    def confidence_intervals(self, level=0.95):
+        return _percentile_intervals(self.param_names, self.samples, level)
+
+    def area_intervals(self, level=0.95):
+        return _percentile_intervals(self.component_names, self.areas, level)
+
+    def area_distribution(self, name):
+        return self.areas[:, self.component_names.index(name)]
+
+    def report(self, level=0.95):
+        state = "cancelled" if self.cancelled else "converged" if self.converged else "not converged"
+        lines = [f"Bootstrap over {self.n_samples} resamples ({state}), {level:.0%} intervals"]
+        for name, (lo, hi) in self.confidence_intervals(level).items():
+            lines.append(f"{name}: {self.best_values[name]:.5g}  [{lo:.5g}, {hi:.5g}]")
+        for name, (lo, hi) in self.area_intervals(level).items():
+            lines.append(f"{name} area: {self.best_areas[name]:.5g}  [{lo:.5g}, {hi:.5g}]")
+        return "\n".join(lines)
+
+
+def _percentile_intervals(names, samples, level):
+    tail = 50 * (1 - level)
+    lo, hi = np.nanpercentile(samples, [tail, 100 - tail], axis=0)
+    return {n: (lo[i], hi[i]) for i, n in enumerate(names)}
+
+
+def _component_areas(result, x, y):
+    comps = result.eval_components(x=x, y=y)
+    return [abs(trapezoid(np.broadcast_to(comps[p], x.shape), x)) for p in comps.keys()]
+
+
+def _refit_batch(component_models, params, x, weights, resampled):
+    """
+    Refit every row of resampled starting from params. Runs inside a worker process, so it only receives
+    plain lmfit objects and arrays - the composite model is rebuilt here because it can't be pickled.
+    """
+    fitting_model = functools.reduce(operator.add, component_models)
+    names = [n for n, p in params.items() if p.vary]
+    values = np.full((len(resampled), len(names)), np.nan)
+    areas = np.full((len(resampled), len(component_models)), np.nan)
+    for i, y in enumerate(resampled):
+        try:
+            result = fitting_model.fit(y, params, x=x, y=y, weights=weights)
+        except (ValueError, RuntimeError):
+            continue
+        values[i] = [result.params[n].value for n in names]
+        areas[i] = _component_areas(result, x, y)
+    return values, areas
+
+
+def _resample(rng, method, best_fit, weights, residuals, n):
+    if method == "residuals":
+        # residuals are weighted, so scale them back to each point's own noise level. Points left out of the
+        # fit (zero weight) keep the best fit
+        scale = np.divide(1, weights, out=np.zeros_like(weights), where=weights > 0)
+        return best_fit + rng.choice(residuals, size=(n, len(best_fit)), replace=True) * scale
+    elif method == "poisson":
+        return rng.poisson(np.clip(best_fit, 0, None), size=(n, len(best_fit))).astype(float)
+    raise ValueError(f"Unknown resampling method {method}, use \"residuals\" or \"poisson\"")
+
+
+def _intervals_stable(previous, current, tol):
+    if previous is None:
+        return False
+    width = np.abs(current[1] - current[0])
+    width[width == 0] = 1
+    change = np.max(np.abs(current - previous) / width)
+    return change < tol
+
+
+def bootstrap_uncertainties(x, data, models, n_samples=1000, method="residuals", level=0.95, batch_size=None,
+                            n_workers=None, tol=0.02, min_samples=100, seed=None, best_result=None, cache=None,
+                            mask=None, progress=None):
+    """
+    Estimate parameter confidence intervals and peak area distributions by refitting resampled spectra.
+
+    The best fit is found first (or taken from best_result), then each resample is either the best fit plus
+    weighted residuals drawn with replacement (method="residuals") or Poisson counts drawn around the best fit
+    (method="poisson"). Resamples are refitted in parallel batches, warm started from the best fit parameters.
+    After every batch the intervals are compared with the previous batch and sampling stops early once no
+    interval bound has moved by more than tol times its interval width. progress, if given, is called after
+    every batch with the number of resamples drawn so far and n_samples; returning False stops sampling and
+    the intervals are computed from the resamples refitted until then.
+
+    :param models: list of Components, as passed to MoreModels.optimise_multiple_models
+    :param n_samples: upper limit on the number of resamples
+    :param n_workers: number of worker processes, 1 runs everything in this process
+    :param cache: optional FitCache used for the initial best fit
+    :param mask: optional points to leave out of every fit, see MoreModels.fit_weights
+    :param progress: optional callable(attempted, n_samples), return False to cancel
+    :returns: BootstrapResult
+    """
+    x = np.asarray(x, dtype=float)
+    data = np.asarray(data, dtype=float)
+    if best_result is None:
+        best_result = MoreModels.optimise_multiple_models(x, data, models, cache=cache, mask=mask)
+    component_models = [m.peak_model for m in models]
+    params = best_result.params
+    weights = MoreModels.fit_weights(data, mask)
+    names = [n for n, p in params.items() if p.vary]
+    best_areas = dict(zip(best_result.eval_components(x=x, y=data).keys(), _component_areas(best_result, x, data)))
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if batch_size is None:
+        batch_size = max(4 * n_workers, 20)
+    rng = np.random.default_rng(seed)
+    residuals = ((data - best_result.best_fit) * weights)[weights > 0]
+
+    all_values = np.empty((0, len(names)))
+    all_areas = np.empty((0, len(best_areas)))
+    attempted = 0
+    previous = None
+    converged = False
+    cancelled = False
+    history = []
+
+    executor = MoreModels.make_process_pool(n_workers, component_models, params)
+    try:
+        while attempted < n_samples:
+            n_batch = min(batch_size, n_samples - attempted)
+            attempted += n_batch
+            resampled = _resample(rng, method, best_result.best_fit, weights, residuals, n_batch)
+            if executor is None:
+                chunks = [_refit_batch(component_models, params, x, weights, resampled)]
+            else:
+                futures = [executor.submit(_refit_batch, component_models, params, x, weights, chunk)
+                           for chunk in np.array_split(resampled, min(n_workers, n_batch)) if len(chunk)]
+                chunks = [f.result() for f in futures]
+            for values, areas in chunks:
+                ok = ~np.any(np.isnan(values), axis=1)
+                all_values = np.vstack((all_values, values[ok]))
+                all_areas = np.vstack((all_areas, areas[ok]))
+
+            if progress is not None and progress(attempted, n_samples) is False:
+                cancelled = True
+                break
+            if all_values.shape[0] == 0:
+                continue
+            tail = 50 * (1 - level)
+            current = np.nanpercentile(np.hstack((all_values, all_areas)), [tail, 100 - tail], axis=0)
+            history.append(all_values.shape[0])
+            if all_values.shape[0] >= min_samples and _intervals_stable(previous, current, tol):
+                converged = True
+                break
+            previous = current
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return BootstrapResult(param_names=names, samples=all_values, component_names=list(best_areas.keys()),
+                           areas=all_areas, best_values={n: params[n].value for n in names},
+                           best_areas=best_areas, converged=converged, cancelled=cancelled,
+                           history=history)
@@ -0,0 +1,94 @@
+import functools
+import threading
+
+from PyQt6.QtCore import QCoreApplication, QObject, QThread, pyqtSignal, pyqtSlot
+
+import Bootstrap
+import PreviewWorker
+
+
+class _Worker(QObject):
+    progress = pyqtSignal(int, int)  # resamples drawn so far, upper limit
+    finished = pyqtSignal(object)  # BootstrapResult
+    failed = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        # called from the GUI thread, checked between batches
+        self._cancel.set()
+
+    def _report(self, attempted, n_samples):
+        self.progress.emit(attempted, n_samples)
+        return not self._cancel.is_set()
+
+    @pyqtSlot(object)
+    def run(self, job):
+        args, kwargs = job
+        try:
+            result = Bootstrap.bootstrap_uncertainties(*args, progress=self._report, **kwargs)
+        except (ValueError, ArithmeticError, RuntimeError) as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(result)
+
+
+def _stop(worker, thread):
+    worker.cancel()
+    PreviewWorker.stop_thread(thread)
+
+
+class BootstrapRunner(QObject):
+    """
+    Runs Bootstrap.bootstrap_uncertainties on a worker thread, so the window stays responsive while the
+    resamples are refitted.
+
+    Progress is announced after every batch; cancel stops sampling after the batch being refitted and the
+    result is still announced with finished, computed from the resamples done so far. One run at a time.
+    """
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    _request = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.running = False
+        self._thread = QThread(self)
+        self._worker = _Worker()
+        self._worker.moveToThread(self._thread)
+        self._request.connect(self._worker.run)
+        self._worker.progress.connect(self.progress)
+        self._worker.finished.connect(self._on_finished)
+        self._worker.failed.connect(self._on_failed)
+        self._thread.start()
+        # stopped however the window goes away, see PreviewWorker.PreviewEvaluator
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+        self.destroyed.connect(functools.partial(_stop, self._worker, self._thread))
+
+    def start(self, *args, **kwargs):
+        """
+        Start a bootstrap with the arguments of Bootstrap.bootstrap_uncertainties, none of which may be changed
+        by the caller until it has finished.
+        """
+        if self.running:
+            raise RuntimeError("A bootstrap is already running")
+        self.running = True
+        self._worker._cancel.clear()
+        self._request.emit((args, kwargs))
+
+    def cancel(self):
+        self._worker.cancel()
+
+    def _on_finished(self, result):
+        self.running = False
+        self.finished.emit(result)
+
+    def _on_failed(self, message):
+        self.running = False
+        self.failed.emit(message)
+
+    def stop(self):
+        _stop(self._worker, self._thread)
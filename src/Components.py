@@ -0,0 +1,364 @@
+from argparse import ArgumentError
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass(slots=True)
+class BoundedValue:
+    value: float
+    min_val: float
+    max_val: float
+
+    def set_value(self, new_value):
+        if new_value < self.min_val:
+            self.value = self.min_val
+        elif new_value > self.max_val:
+            self.value = self.max_val
+        else:
+            self.value = new_value
+
+    def set_lims(self, new_lims):
+        if new_lims[1] > new_lims[0]:
+            self.min_val = new_lims[0]
+            self.max_val = new_lims[1]
+            self.set_value(self.value)
+
+    def set_min(self, new_min):
+        if new_min < self.max_val:
+            self.min_val = new_min
+            self.set_value(self.value)
+
+    def set_max(self, new_max):
+        if new_max > self.min_val:
+            self.max_val = new_max
+            self.set_value(self.value)
+
+    def to_slider_dict(self):
+        return {'value': self.value, 'min': self.min_val, 'max': self.max_val}
+
+    @classmethod
+    def from_slider_dict(cls, data: dict):
+        """
+        Create an instance from a dictionary.
+        Expects keys: 'value', 'min', 'max'.
+        """
+        if "value" in data.keys():
+            if ("min" not in data.keys()) and ("max" not in data.keys()):
+                if data["value"] == 0:
+                    data["min"] = -1
+                    data["max"] = 1
+                else:
+                    data["min"] = min(0, data["value"] * 2)
+                    data["max"] = max(0, data["value"] * 2)
+            elif "min" not in data.keys():
+                data["min"] = data["max"] - abs(data["value"] * 2)
+            elif "max" not in data.keys():
+                data["max"] = data["min"] + abs(data["value"] * 2)
+        elif "min" in data.keys():
+            # value isn't in dict
+            if "max" not in data.keys():
+                if data["min"] >= 0:
+                    data["max"] = (data["min"] + 0.5) * 2
+                else:
+                    data["max"] = 0
+            data["value"] = 0.5 * (data["min"] + data["max"])
+        elif "max" in data.keys():
+            # value isn't in dict
+            if "min" not in data.keys():
+                if data["max"] >= 0:
+                    data["min"] = (data["max"] - 1) / 2
+                else:
+                    data["min"] = 0
+            data["value"] = 0.5 * (data["min"] + data["max"])
+        else:
+            raise ArgumentError(None, "Dictionary had none of \"min\", \"max\", or \"value\"")
+
+        return cls(
+            value=data.get('value'),
+            min_val=data.get('min'),
+            max_val=data.get('max'),
+        )
+
+
+PARAMETER_DTYPE = np.dtype([('value', float), ('min', float), ('max', float), ('vary', bool)])
+
+
+def clamp(values, min_val, max_val):
+    """
+    Vectorised BoundedValue.set_value: values below min_val become min_val, then values above max_val become
+    max_val (so min_val wins where the limits are the wrong way round), NaN is kept.
+    """
+    values = np.asarray(values, dtype=float)
+    return np.where(values < min_val, min_val, np.where(values > max_val, max_val, values))
+
+
+class ParameterStore:
+    """
+    Values, limits and vary flags of many parameters for many parameter sets (e.g. every pixel of a map, or every
+    spectrum of a global fit), in one (n_sets, n_params) structured array of PARAMETER_DTYPE.
+
+    Parameters of one component are adjacent columns, so component returns a view rather than a copy, as do
+    the field properties (values, minima, maxima, vary). Writes through set_values and set_limits clamp like
+    BoundedValue does.
+    """
+
+    def __init__(self, names, n_sets=1, groups=None):
+        """
+        :param names: parameter names, the columns
+        :param groups: optional {name: (first column, last column + 1)}, e.g. one per component
+        """
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.groups = dict(groups or {})
+        self.data = np.zeros((n_sets, len(self.names)), dtype=PARAMETER_DTYPE)
+        self.data['min'] = -np.inf
+        self.data['max'] = np.inf
+        self.data['vary'] = True
+
+    @classmethod
+    def from_components(cls, components, n_sets=1):
+        """
+        Every set starts from the current values and limits of components, each component a group of columns
+        named after it.
+        """
+        names, groups = [], {}
+        for component in components:
+            start = len(names)
+            names.extend(component.get_all_params())
+            groups[component.get_name()] = (start, len(names))
+        store = cls(names, n_sets, groups)
+        for name, value in (item for c in components for item in c.get_all_params().items()):
+            store.data[:, store.index[name]] = (value.value, value.min_val, value.max_val, True)
+        return store
+
+    @classmethod
+    def from_parameters(cls, params, n_sets=1):
+        """
+        Every set starts from an lmfit.Parameters. Parameters that are fixed or given by an expression don't vary.
+        """
+        store = cls(params.keys(), n_sets)
+        for i, par in enumerate(params.values()):
+            store.data[:, i] = (par.value, par.min, par.max, par.vary and par.expr is None)
+        return store
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    @property
+    def values(self):
+        return self.data['value']
+
+    @property
+    def minima(self):
+        return self.data['min']
+
+    @property
+    def maxima(self):
+        return self.data['max']
+
+    @property
+    def vary(self):
+        return self.data['vary']
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def columns(self, names):
+        return np.array([self.index[name] for name in names], dtype=int)
+
+    def component(self, name):
+        """
+        View of the columns of one group, changes to it change the store.
+        """
+        start, stop = self.groups[name]
+        return self.data[:, start:stop]
+
+    def clamp(self):
+        """
+        Bring every value back within its limits, in place.
+        """
+        self.data['value'] = clamp(self.data['value'], self.data['min'], self.data['max'])
+
+    def set_values(self, values, sets=slice(None), columns=slice(None)):
+        """
+        Set values, clamped to the limits as BoundedValue.set_value does.
+
+        :param values: anything that broadcasts to data[sets, columns]
+        """
+        block = self.data[sets, columns]
+        self.data['value'][sets, columns] = clamp(np.broadcast_to(values, block.shape), block['min'], block['max'])
+
+    def set_limits(self, min_val, max_val, sets=slice(None), columns=slice(None)):
+        """
+        Set limits and clamp the values to them, as BoundedValue.set_lims does. Where max_val isn't above
+        min_val the old limits are kept.
+        """
+        block = self.data[sets, columns]
+        min_val = np.broadcast_to(min_val, block.shape)
+        max_val = np.broadcast_to(max_val, block.shape)
+        valid = max_val > min_val
+        block['min'] = np.where(valid, min_val, block['min'])
+        block['max'] = np.where(valid, max_val, block['max'])
+        block['value'] = clamp(block['value'], block['min'], block['max'])
+        self.data[sets, columns] = block
+
+    def bounded_value(self, name, set_index=0) -> BoundedValue:
+        record = self.data[set_index, self.index[name]]
+        return BoundedValue(float(record['value']), float(record['min']), float(record['max']))
+
+    def to_parameters(self, set_index=0, params=None):
+        """
+        One set as lmfit.Parameters, or written into params (whose expressions are kept) if given.
+        """
+        if params is None:
+            import lmfit
+            params = lmfit.Parameters()
+        for name, record in zip(self.names, self.data[set_index]):
+            if name in params:
+                params[name].set(value=record['value'], min=record['min'], max=record['max'])
+                if params[name].expr is None:
+                    params[name].set(vary=bool(record['vary']))
+            else:
+                params.add(name, value=record['value'], min=record['min'], max=record['max'],
+                           vary=bool(record['vary']))
+        return params
+
+
+class Component:
+    """
+    One component of a fit without any widgets: its lmfit model, name, and the value and limits of each
+    parameter, with a cache of recent evaluations.
+
+    This is what the fitting functions (MoreModels.optimise_multiple_models, MapFitting.fit_map, ...) take, so
+    they can run in scripts and worker processes without Qt. The GUI uses CustomWidgets.PeakDataModel, which
+    adds signals on top.
+    """
+
+    def __init__(self, peak_model: "lmfit.Model", **kwargs):
+        # kwargs are passed on, so a Qt adapter can inherit from QObject and Component together
+        super().__init__(**kwargs)
+        self.peak_model = peak_model
+        self._params = {}  # {str: BoundedValue}
+        self._peak_name = peak_model.prefix
+        # recent evaluations {array key: (parameter values, arrays evaluated on, output)}, see evaluate
+        self._cache = {}
+
+        param_hints = getattr(peak_model, "param_hints", {})
+        for param_name in peak_model.param_names:
+            # adding detail to the param_hints to get a fully fleshed out dict params = {name: {min: , max:, value: }}
+            if param_name.removeprefix(peak_model.prefix) in peak_model.independent_vars:
+                continue
+
+            hint = param_hints.get(param_name.removeprefix(peak_model.prefix), {})
+            if hint == {}:
+                hint["value"] = peak_model.def_vals.get(param_name.removeprefix(peak_model.prefix), 1)
+            try:
+                value = BoundedValue.from_slider_dict(hint)
+                self._params[param_name] = value
+            except ArgumentError:
+                pass
+
+    def __getstate__(self):
+        # the cache is keyed on ids, which mean nothing in another process
+        state = self.__dict__.copy()
+        state["_cache"] = {}
+        return state
+
+    def set_name(self, name):
+        self._peak_name = name
+
+    def get_name(self):
+        return self._peak_name
+
+    def get_all_params(self):
+        return self._params
+
+    def get_param(self, name):
+        return self._params[name]
+
+    def set_param(self, name, value: BoundedValue):
+        if name in self._params:
+            self._params[name] = value
+            self.invalidate_cache()
+
+    def set_params(self, values: dict):
+        """
+        Replace several parameters at once ({name: BoundedValue}).
+
+        :returns: the names that were replaced, names this component doesn't have are ignored
+        """
+        changed = [name for name in values if name in self._params]
+        for name in changed:
+            self._params[name] = values[name]
+        if changed:
+            self.invalidate_cache()
+        return changed
+
+    def make_model_parameters(self, model_params=None):
+        if model_params is None:
+            import lmfit
+            model_params = lmfit.Parameters()
+        for k, v in self._params.items():
+            assert isinstance(v, BoundedValue)
+            model_params.add(k, min=v.min_val, max=v.max_val, value=v.value)
+        return model_params
+
+    def get_model_and_params_for_fitting(self, model_params=None):
+        return self.peak_model, self.make_model_parameters(model_params)
+
+    def eval_requirements(self) -> list:
+        return self.peak_model.independent_vars
+
+    cache_size = 4  # evaluations kept, e.g. on the data grid and on a finer preview grid
+
+    def invalidate_cache(self, *args):
+        self._cache = {}
+
+    def _cache_key(self, x, kwargs):
+        arrays = tuple((k, id(v)) for k, v in sorted(kwargs.items()) if isinstance(v, np.ndarray))
+        others = tuple((k, v) for k, v in sorted(kwargs.items()) if not isinstance(v, np.ndarray))
+        return id(x), arrays, others
+
+    def param_values(self):
+        return tuple((k, v.value, v.min_val, v.max_val) for k, v in self._params.items())
+
+    def cached_evaluation(self, x, **kwargs):
+        """
+        The output evaluate would return, if it is cached for the current parameters, otherwise None.
+        """
+        cached = self._cache.get(self._cache_key(x, kwargs))
+        if cached is not None and cached[0] == self.param_values():
+            return cached[2]
+        return None
+
+    def store_evaluation(self, x, kwargs, values, output):
+        """
+        Cache an output evaluated elsewhere (e.g. in a worker thread) for the parameter values it was evaluated
+        with, as returned by param_values. Nothing is stored if the parameters have changed since.
+
+        :returns: whether the output was stored
+        """
+        if values != self.param_values():
+            return False
+        output = np.asarray(output)
+        output.setflags(write=False)  # in place, so the caller's array is read only too
+        key = self._cache_key(x, kwargs)
+        # the arrays are kept alive with the entry so their ids can't be reused by new arrays
+        self._cache.pop(key, None)
+        self._cache[key] = (values, (x, kwargs), output)
+        while len(self._cache) > self.cache_size:
+            del self._cache[next(iter(self._cache))]
+        return True
+
+    def evaluate(self, x, **kwargs):
+        """
+        Evaluate the component, reusing earlier results while the parameters and the x (and y etc.) arrays are the
+        same objects. The arrays must not be modified in place between calls, and the returned array is read only.
+        """
+        output = self.cached_evaluation(x, **kwargs)
+        if output is None:
+            output = np.asarray(self.peak_model.eval(params=self.make_model_parameters(), x=x, **kwargs))
+            self.store_evaluation(x, kwargs, self.param_values(), output)
+        return output
@@ -0,0 +1,154 @@
+import ast
+import functools
+import graphlib
+
+import numpy as np
+import scipy.special
+
+
+def _reduce(ufunc):
+    # max(a, b, c) as asteval evaluates it, elementwise so it works on arrays of parameter sets
+    def reduce(*args):
+        return functools.reduce(ufunc, args)
+    return reduce
+
+
+# functions and constants constraint expressions can use, working on arrays of parameter sets as well as scalars.
+# These are the names lmfit's own hints use (the NumPy functions asteval knows and lmfit's SCIPY_FUNCTIONS)
+NAMESPACE = {
+    "sqrt": np.sqrt, "exp": np.exp, "expm1": np.expm1, "log": np.log, "log10": np.log10, "log1p": np.log1p,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "arcsin": np.arcsin, "arccos": np.arccos, "arctan": np.arctan,
+    "arctan2": np.arctan2, "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh, "abs": np.abs, "fabs": np.fabs,
+    "sign": np.sign, "square": np.square, "power": np.power, "hypot": np.hypot, "floor": np.floor, "ceil": np.ceil,
+    "where": np.where, "max": _reduce(np.maximum), "min": _reduce(np.minimum), "real": np.real, "imag": np.imag,
+    "pi": np.pi, "e": np.e, "inf": np.inf, "nan": np.nan,
+    "gamfcn": scipy.special.gamma, "loggammafcn": scipy.special.loggamma, "betalnfnc": scipy.special.betaln,
+    "erf": scipy.special.erf, "erfc": scipy.special.erfc, "wofz": scipy.special.wofz, "__builtins__": {},
+}
+
+
+def _bound(value, min_val, max_val):
+    # as lmfit bounds a constrained parameter: the maximum is checked first
+    return np.where(value > max_val, max_val, np.where(value < min_val, min_val, value))
+
+
+# the syntax constraint expressions may use: arithmetic, comparisons and calls of the functions in NAMESPACE.
+# Like asteval, attribute access, lambdas and comprehensions are rejected, they reach past the namespace
+_ALLOWED_NODES = (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Call, ast.keyword, ast.Name,
+                  ast.Constant, ast.Tuple, ast.List, ast.expr_context, ast.operator, ast.unaryop, ast.boolop,
+                  ast.cmpop)
+
+
+def _check_syntax(name, expression, tree):
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Constraint {name} = {expression} uses {type(node).__name__}, which isn't allowed")
+        if isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+            raise ValueError(f"Constraint {name} = {expression} calls something other than a named function")
+
+
+class _ToColumns(ast.NodeTransformer):
+    """
+    Replaces parameter names by the matching column of the parameter array, values[..., i].
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def visit_Name(self, node):
+        if node.id not in self.index:
+            return node
+        column = ast.Tuple(elts=[ast.Constant(Ellipsis), ast.Constant(self.index[node.id])], ctx=ast.Load())
+        return ast.copy_location(ast.Subscript(value=ast.Name(id="values", ctx=ast.Load()), slice=column,
+                                               ctx=ast.Load()), node)
+
+
+class ConstraintSet:
+    """
+    Parameter constraints (lmfit expressions, e.g. "2*p_gaussian_sigma*1.17741" or "d1_sigma") compiled once into
+    NumPy assignments on a parameter array.
+
+    The expressions are parsed when the set is made, sorted so every parameter is computed after the ones it
+    depends on, and turned into a single function that assigns all constrained columns of an (..., n_params)
+    array in place. Applying the constraints during a fit is then one Python call with one array operation per
+    constraint, for one parameter set or a whole stack of them, instead of an asteval evaluation per parameter.
+
+    MapFitting and GlobalFitting fit with it. Single fits (MoreModels.optimise_multiple_models, and so bootstrap
+    and model selection) stay on lmfit, whose ModelResult also carries the uncertainties of the constrained
+    parameters.
+    """
+
+    def __init__(self, names, expressions, bounds=None):
+        """
+        :param names: parameter names, in the order of the columns of the arrays passed to apply
+        :param expressions: {name: expression} for the constrained parameters
+        :param bounds: optional {name: (min, max)} that the constrained values are kept within, as lmfit does
+        :raises ValueError: for expressions that don't parse, use syntax other than arithmetic, comparisons and calls
+            (e.g. attribute access or lambdas), use unknown names, or depend on each other in a circle
+        """
+        self.names = list(names)
+        index = {name: i for i, name in enumerate(self.names)}
+        bounds = bounds or {}
+
+        trees, dependencies = {}, {}
+        for name, expression in expressions.items():
+            if name not in index:
+                raise ValueError(f"Constraint for unknown parameter {name}")
+            try:
+                trees[name] = ast.parse(expression.strip(), mode='eval').body
+            except SyntaxError as e:
+                raise ValueError(f"Can't parse the constraint {name} = {expression}: {e.msg}") from None
+            _check_syntax(name, expression, trees[name])
+            used = {node.id for node in ast.walk(trees[name]) if isinstance(node, ast.Name)}
+            unknown = sorted(used - set(index) - set(NAMESPACE))
+            if unknown:
+                raise ValueError(f"Constraint {name} = {expression} uses unknown names {', '.join(unknown)}")
+            dependencies[name] = used & set(expressions)
+        try:
+            self.order = list(graphlib.TopologicalSorter(dependencies).static_order())
+        except graphlib.CycleError as e:
+            raise ValueError(f"Constraints depend on each other in a circle: {' -> '.join(e.args[1])}") from None
+        self.expressions = {name: expressions[name] for name in self.order}
+        self.columns = np.array([index[name] for name in self.order], dtype=int)
+
+        to_columns = _ToColumns(index)
+        body = []
+        for name in self.order:
+            value = to_columns.visit(trees[name])
+            min_val, max_val = bounds.get(name, (-np.inf, np.inf))
+            if np.isfinite(min_val) or np.isfinite(max_val):
+                value = ast.Call(func=ast.Name(id="_bound", ctx=ast.Load()),
+                                 args=[value, ast.Constant(float(min_val)), ast.Constant(float(max_val))], keywords=[])
+            column = ast.Tuple(elts=[ast.Constant(Ellipsis), ast.Constant(index[name])], ctx=ast.Load())
+            target = ast.Subscript(value=ast.Name(id="values", ctx=ast.Load()), slice=column, ctx=ast.Store())
+            body.append(ast.Assign(targets=[target], value=value))
+        body.append(ast.Return(value=ast.Name(id="values", ctx=ast.Load())))
+        function = ast.FunctionDef(name="apply_constraints",
+                                   args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="values")], kwonlyargs=[],
+                                                      kw_defaults=[], defaults=[]),
+                                   body=body, decorator_list=[])
+        module = ast.fix_missing_locations(ast.Module(body=[function], type_ignores=[]))
+        namespace = dict(NAMESPACE, _bound=_bound)
+        exec(compile(module, "<constraints>", "exec"), namespace)
+        self._apply = namespace["apply_constraints"]
+
+    @classmethod
+    def from_parameters(cls, params):
+        """
+        The constraints of an lmfit.Parameters, with its parameters as the columns.
+        """
+        expressions = {name: par.expr for name, par in params.items() if par.expr is not None}
+        bounds = {name: (params[name].min, params[name].max) for name in expressions}
+        return cls(params.keys(), expressions, bounds)
+
+    def __len__(self):
+        return len(self.order)
+
+    def apply(self, values):
+        """
+        Compute the constrained parameters in place.
+
+        :param values: (n_params,) parameter vector or (..., n_params) stack of them, as floats
+        :returns: values
+        """
+        return self._apply(values)
@@ -1,91 +1,13 @@
-from argparse import ArgumentError
-from dataclasses import dataclass
+import time
 import platform
 
-import lmfit.models
 from PyQt6.QtCore import Qt, pyqtSignal, QObject, QPoint
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QLabel, QMessageBox, QLineEdit, QSlider, QHBoxLayout, QSizePolicy, QGridLayout,
-    QGroupBox, QFormLayout, QMenu, QSpacerItem
+    QGroupBox, QFormLayout, QMenu, QSpacerItem, QToolButton, QScrollArea
 )
-from lmfit.models import VoigtModel
 
-
-@dataclass
-class BoundedValue:
-    value: float
-    min_val: float
-    max_val: float
-
-    def set_value(self, new_value):
-        if new_value < self.min_val:
-            self.value = self.min_val
-        elif new_value > self.max_val:
-            self.value = self.max_val
-        else:
-            self.value = new_value
-
-    def set_lims(self, new_lims):
-        if new_lims[1] > new_lims[0]:
-            self.min_val = new_lims[0]
-            self.max_val = new_lims[1]
-            self.set_value(self.value)
-
-    def set_min(self, new_min):
-        if new_min < self.max_val:
-            self.min_val = new_min
-            self.set_value(self.value)
-
-    def set_max(self, new_max):
-        if new_max > self.min_val:
-            self.max_val = new_max
-            self.set_value(self.value)
-
-    def to_slider_dict(self):
-        return {'value': self.value, 'min': self.min_val, 'max': self.max_val}
-
-    @classmethod
-    def from_slider_dict(cls, data: dict):
-        """
-        Create an instance from a dictionary.
-        Expects keys: 'value', 'min', 'max'.
-        """
-        if "value" in data.keys():
-            if ("min" not in data.keys()) and ("max" not in data.keys()):
-                if data["value"] == 0:
-                    data["min"] = -1
-                    data["max"] = 1
-                else:
-                    data["min"] = min(0, data["value"] * 2)
-                    data["max"] = max(0, data["value"] * 2)
-            elif "min" not in data.keys():
-                data["min"] = data["max"] - abs(data["value"] * 2)
-            elif "max" not in data.keys():
-                data["max"] = data["min"] + abs(data["value"] * 2)
-        elif "min" in data.keys():
-            # value isn't in dict
-            if "max" not in data.keys():
-                if data["min"] >= 0:
-                    data["max"] = (data["min"] + 0.5) * 2
-                else:
-                    data["max"] = 0
-            data["value"] = 0.5 * (data["min"] + data["max"])
-        elif "max" in data.keys():
-            # value isn't in dict
-            if "min" not in data.keys():
-                if data["max"] >= 0:
-                    data["min"] = (data["max"] - 1) / 2
-                else:
-                    data["min"] = 0
-            data["value"] = 0.5 * (data["min"] + data["max"])
-        else:
-            raise ArgumentError(None, "Dictionary had none of \"min\", \"max\", or \"value\"")
-
-        return cls(
-            value=data.get('value'),
-            min_val=data.get('min'),
-            max_val=data.get('max'),
-        )
+from Components import BoundedValue, Component
 
 
 class QSliderLineEdit(QLineEdit):
@@ -277,10 +199,23 @@ class QAdjustableSlider(QWidget):
         self.value_edit.set_to_font_width()
 
     def set_from_bounded_value(self, bounded_value):
+        """
+        Show bounded_value's value and limits without emitting valueChanged or limit_changed.
+        """
         assert isinstance(bounded_value, BoundedValue)
-        self.slider.setValue(bounded_value.value)
-        self.min_edit.setText(str(bounded_value.min_val))
-        self.max_edit.setText(str(bounded_value.max_val))
+        self._internal_update = True
+        self.min_val = bounded_value.min_val
+        self.max_val = bounded_value.max_val
+        self.slider.blockSignals(True)
+        self.slider.setMinimum(0)
+        self.slider.setMaximum(int(round((self.max_val - self.min_val) / self.step)))
+        self.slider.setValue(int(round((bounded_value.value - self.min_val) / self.step)))
+        self.slider.blockSignals(False)
+        self.value_edit.setText(f"{bounded_value.value:.{self.decimals}f}")
+        self.value_edit.set_to_font_width()
+        self.min_edit.setText(f"{self.min_val:.{self.decimals}f}")
+        self.max_edit.setText(f"{self.max_val:.{self.decimals}f}")
+        self._internal_update = False
 
     def value(self):
         try:
@@ -289,92 +224,112 @@ class QAdjustableSlider(QWidget):
             return self.min_val
 
 
-class PeakDataModel(QObject):
+class PeakDataModel(QObject, Component):
+    """
+    A Component that announces its changes with Qt signals, for the widgets showing it.
+    """
     param_changed = pyqtSignal(str, object)  # param_name, new_value for the slider
+    params_changed = pyqtSignal(list)  # param_names, after set_params
     name_changed = pyqtSignal(str)  # new_value
 
-    def __init__(self, peak_model: lmfit.Model):
-        super().__init__()
-        self.peak_model = peak_model
-        self._params = {}  # {str: BoundedValue}
-        self._peak_name = peak_model.prefix
+    def __init__(self, peak_model: "lmfit.Model"):
+        super().__init__(peak_model=peak_model)
         self._internal_update = False
 
-        param_hints = getattr(peak_model, "param_hints", {})
-        for param_name in peak_model.param_names:
-            # adding detail to the param_hints to get a fully fleshed out dict params = {name: {min: , max:, value: }}
-            if param_name.removeprefix(peak_model.prefix) in peak_model.independent_vars:
-                continue
-
-            hint = param_hints.get(param_name.removeprefix(peak_model.prefix), {})
-            if hint == {}:
-                hint["value"] = peak_model.def_vals.get(param_name.removeprefix(peak_model.prefix), 1)
-            try:
-                value = BoundedValue.from_slider_dict(hint)
-                self._params[param_name] = value
-            except ArgumentError:
-                pass
-
     def set_name(self, name):
         if self._internal_update:
             return
         self._internal_update = True
-        self._peak_name = name
+        super().set_name(name)
         self.name_changed.emit(name)
         self._internal_update = False
 
-    def get_name(self):
-        return self._peak_name
-
-    def get_all_params(self):
-        return self._params
-
-    def get_param(self, name):
-        return self._params[name]
-
     def set_param(self, name, value: BoundedValue):
         if self._internal_update:
             return
         self._internal_update = True
         if name in self._params:
-            self._params[name] = value
+            super().set_param(name, value)
             self.param_changed.emit(name, value)
-
         self._internal_update = False
 
-    def make_model_parameters(self, model_params=None):
-        if model_params is None:
-            model_params = lmfit.Parameters()
-        for k, v in self._params.items():
-            assert isinstance(v, BoundedValue)
-            model_params.add(k, min=v.min_val, max=v.max_val, value=v.value)
-        return model_params
-
-    def eval_requirements(self) -> list:
-        return self.peak_model.independent_vars
-
-    def evaluate(self, x, **kwargs):
-        return self.peak_model.eval(params=self.make_model_parameters(), x=x, **kwargs)
-
-    def get_model_and_params_for_fitting(self, model_params=None):
-        return self.peak_model, self.make_model_parameters(model_params)
+    def set_params(self, values: dict):
+        """
+        Replace several parameters at once ({name: BoundedValue}), with a single params_changed notification.
+        """
+        if self._internal_update:
+            return []
+        self._internal_update = True
+        changed = super().set_params(values)
+        if changed:
+            self.params_changed.emit(changed)
+        self._internal_update = False
+        return changed
 
 
 class QModelParamGroup(QGroupBox):
     paramChanged = pyqtSignal(str)
     request_deletion = pyqtSignal(str)
 
-    def __init__(self, peak_model: PeakDataModel, parent=None):
+    def __init__(self, peak_model: PeakDataModel, parent=None, scheduler=None, expanded=True):
         super().__init__(parent)
         self.data_model = peak_model
         self.setTitle(self.data_model.get_name())
         self._internal_update = False
+        # optional RenderScheduler that slider changes are routed through, so only the latest per frame applies
+        self.scheduler = scheduler
 
-        form_layout = QFormLayout()
-
+        # the sliders are only built the first time the group is expanded, collapsed it shows a one line summary
         self.sliders = {}
+        self.editor = None
 
-        for name, value in peak_model.get_all_params().items():
+        layout = QVBoxLayout(self)
+        header = QHBoxLayout()
+        self.expand_button = QToolButton()
+        self.expand_button.setCheckable(True)
+        self.expand_button.setArrowType(Qt.ArrowType.RightArrow)
+        self.expand_button.toggled.connect(self.set_expanded)
+        header.addWidget(self.expand_button)
+        self.summary = QLabel()
+        header.addWidget(self.summary)
+        layout.addLayout(header)
+
+        # Connect model changes to slider updates
+        self.data_model.param_changed.connect(self._on_param_changed)
+        self.data_model.params_changed.connect(self._on_params_changed)
+
+        # Enable context menu events
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
+        self.customContextMenuRequested.connect(self.show_context_menu)
+
+        self.update_summary()
+        self.expand_button.setChecked(expanded)
+
+    def set_expanded(self, expanded):
+        if expanded and self.editor is None:
+            self._build_editor()
+        self.expand_button.setChecked(expanded)
+        self.expand_button.setArrowType(Qt.ArrowType.DownArrow if expanded else Qt.ArrowType.RightArrow)
+        if self.editor is not None:
+            self.editor.setVisible(expanded)
+        self.summary.setVisible(not expanded)
+        if not expanded:
+            self.update_summary()
+
+    def is_expanded(self):
+        return self.expand_button.isChecked()
+
+    def update_summary(self):
+        prefix = self.data_model.get_name()
+        self.summary.setText(", ".join(f"{name.removeprefix(prefix)} {value.value:.4g}"
+                                       for name, value in self.data_model.get_all_params().items()))
+
+    def _build_editor(self):
+        self.editor = QWidget()
+        form_layout = QFormLayout(self.editor)
+        form_layout.setContentsMargins(0, 0, 0, 0)
+
+        for name, value in self.data_model.get_all_params().items():
             # Custom slider
             assert isinstance(value, BoundedValue)
             slider = QAdjustableSlider(min_val=value.min_val, max_val=value.max_val, initial=value.value)
@@ -386,36 +341,51 @@ class QModelParamGroup(QGroupBox):
             label.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Fixed)
 
             # Connect slider value changes to model
-            slider.valueChanged.connect(lambda val, n=name: self._update_model_value(n, val))
+            slider.valueChanged.connect(lambda val, n=name: self._on_slider_value(n, val))
             slider.limit_changed.connect(lambda min_val, max_val, n=name:
                                          self._update_model_lims(n, (min_val, max_val))
                                          )
 
             form_layout.addRow(label, slider)
 
-        self.setLayout(form_layout)
+        self.layout().addWidget(self.editor)
 
-        # Connect model changes to slider updates
-        self.data_model.param_changed.connect(self._on_param_changed)
+    def set_param_directly(self, name, value):
+        self.set_params_directly({name: value})
 
-        # Enable context menu events
-        self.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
-        self.customContextMenuRequested.connect(self.show_context_menu)
+    def set_params_directly(self, values: dict):
+        """
+        Apply several parameters in one go, without going through the sliders' signals.
 
-    def set_param_directly(self, name, value):
-        slider = self.sliders.get(name)
-        if slider is not None:
-            assert isinstance(slider, QAdjustableSlider)
+        :param values: {name: BoundedValue or plain value}. A plain value outside the current limits widens them,
+            as typing it into the slider would. Limits with min >= max are ignored.
+        """
+        params = self.data_model.get_all_params()
+        changed = {}
+        for name, value in values.items():
+            if name not in params:
+                continue
+            current = self.data_model.get_param(name)
+            new = BoundedValue(current.value, current.min_val, current.max_val)
             if isinstance(value, BoundedValue):
-                slider.max_edit.setText(str(value.max_val))
-                slider.max_edit.editingFinished.emit()
-                slider.min_edit.setText(str(value.min_val))
-                slider.min_edit.editingFinished.emit()
-                slider.value_edit.setText(str(value.value))
-                slider.value_edit.editingFinished.emit()
+                new.set_lims((value.min_val, value.max_val))
+                new.set_value(value.value)
             else:
-                slider.value_edit.setText(str(value))
-                slider.value_edit.editingFinished.emit()
+                new.set_lims((min(new.min_val, value), max(new.max_val, value)))
+                new.set_value(value)
+            changed[name] = new
+        if not changed:
+            return
+
+        self._internal_update = True
+        self.data_model.set_params(changed)
+        for name, value in changed.items():
+            if name in self.sliders:
+                self.sliders[name].set_from_bounded_value(value)
+        self._internal_update = False
+        if not self.is_expanded():
+            self.update_summary()
+        self.paramChanged.emit(self.data_model.get_name())
 
     def _on_param_changed(self, name, value):
         if self._internal_update:
@@ -423,10 +393,26 @@ class QModelParamGroup(QGroupBox):
         self._internal_update = True
         slider = self.sliders.get(name)
         if slider:
-            slider.slider.setValue(value["value"])
-            slider.min_edit.setText(str(value["min"]))
-            slider.max_edit.setText(str(value["max"]))
+            slider.set_from_bounded_value(value)
+        self._internal_update = False
+
+    def _on_params_changed(self, names):
+        if self._internal_update:
+            return
+        self._internal_update = True
+        for name in names:
+            slider = self.sliders.get(name)
+            if slider:
+                slider.set_from_bounded_value(self.data_model.get_param(name))
         self._internal_update = False
+        if not self.is_expanded():
+            self.update_summary()
+
+    def _on_slider_value(self, name, value):
+        if self.scheduler is None:
+            self._update_model_value(name, value)
+        else:
+            self.scheduler.submit((self.data_model.get_name(), name), lambda: self._update_model_value(name, value))
 
     def _update_model_value(self, name, value):
         if self._internal_update:
@@ -456,12 +442,51 @@ class QModelParamGroup(QGroupBox):
                 self.request_deletion.emit(self.data_model.get_name())
 
 
+class QComponentPanel(QScrollArea):
+    """
+    Scrollable row of QModelParamGroups. Groups are added collapsed unless asked otherwise, so only the
+    components the user opens pay for their sliders.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWidgetResizable(True)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        contents = QWidget()
+        self.row = QHBoxLayout(contents)
+        self.row.addStretch()
+        self.setWidget(contents)
+
+    def add_group(self, group: QModelParamGroup):
+        # before the stretch, which keeps the groups packed to the left
+        self.row.insertWidget(self.row.count() - 1, group)
+        group.setSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Maximum)
+
+
+def time_group_construction(peak_models, expanded):
+    """
+    Seconds taken to build and lay out a QModelParamGroup for each of peak_models, all expanded (every slider
+    built, like the old layout) or all collapsed.
+    """
+    container = QWidget()
+    layout = QHBoxLayout(container)
+    start = time.perf_counter()
+    for peak_model in peak_models:
+        layout.addWidget(QModelParamGroup(peak_model, expanded=expanded))
+    container.adjustSize()
+    elapsed = time.perf_counter() - start
+    container.deleteLater()
+    return elapsed
+
+
 class MainWindow(QWidget):
     def __init__(self):
         super().__init__()
         layout = QVBoxLayout(self)
         self.setLayout(layout)
 
+        from lmfit.models import VoigtModel
+
         # Add a few deletable boxes
         for i in range(3):
             box = QModelParamGroup(PeakDataModel(VoigtModel(prefix="V")))
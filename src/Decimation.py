@@ -0,0 +1,76 @@
+import numpy as np
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, view=None, n_buckets=1000):
+    """
+    Indices of the points worth drawing at a horizontal resolution of n_buckets.
+
+    The points inside the view are split into n_buckets runs of consecutive points, and from each run the points
+    with the smallest and the largest y are kept, together with the first and last point. Drawn through these,
+    a line or scatter covers the same pixels as the full data. The nearest point outside the view on either side
+    is kept as well so lines run to the edge of the axes.
+
+    :param view: (low, high) range of x to keep, in either order, all of x if None
+    :returns: sorted array of indices into x and y
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if view is None:
+        idx = np.arange(x.size)
+    else:
+        low, high = min(view), max(view)
+        inside = (x >= low) & (x <= high)
+        visible = inside.copy()
+        visible[1:] |= inside[:-1]
+        visible[:-1] |= inside[1:]
+        idx = np.flatnonzero(visible)
+    if idx.size <= 2 * n_buckets:
+        return idx
+
+    bucket = (np.arange(idx.size) * n_buckets) // idx.size
+    # lexsort keeps the buckets in order, and sorts by y within each
+    order = np.lexsort((y[idx], bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.r_[starts[1:], idx.size] - 1
+    return np.unique(np.r_[idx[0], idx[order[starts]], idx[order[ends]], idx[-1]])
+
+
+class DisplayDecimator:
+    """
+    Caches minmax_indices of one data set for the last view and resolution asked for.
+    """
+
+    def __init__(self, threshold=5000):
+        self.threshold = threshold  # data with no more points than this is always drawn in full
+        self._x = np.array([])
+        self._y = np.array([])
+        self._key = None
+        self._indices = None
+
+    def set_data(self, x, y):
+        self._x = x
+        self._y = y
+        self._key = None
+        self._indices = None
+
+    @property
+    def x(self):
+        return self._x
+
+    @property
+    def y(self):
+        return self._y
+
+    def indices(self, view, n_buckets):
+        """
+        :returns: indices to draw, or None to draw everything
+        """
+        if self._x.size <= self.threshold:
+            return None
+        # views past the ends of the data select the same points, so share an entry
+        low, high = min(view), max(view)
+        key = (max(low, np.min(self._x)), min(high, np.max(self._x)), int(n_buckets))
+        if key != self._key:
+            self._indices = minmax_indices(self._x, self._y, (low, high), max(int(n_buckets), 1))
+            self._key = key
+        return self._indices
@@ -0,0 +1,174 @@
+import copy
+import hashlib
+import json
+import os
+import types
+
+import lmfit
+import numpy as np
+
+# part of every key, bump it when a change to the fitting code makes the stored results stale
+CACHE_VERSION = 2
+
+
+def _code_digest(code):
+    # nested functions and comprehensions are code objects among the constants, whose repr holds their address
+    parts = [code.co_code.hex(), repr(code.co_names)]
+    for const in code.co_consts:
+        parts.append(_code_digest(const) if isinstance(const, types.CodeType) else repr(const))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+
+def _model_signature(model: lmfit.Model):
+    func = getattr(model, "func", None)
+    code = getattr(func, "__code__", None)
+    return {
+        "class": f"{type(model).__module__}.{type(model).__qualname__}",
+        "func": f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', '')}",
+        "code": None if code is None else _code_digest(code),
+        "prefix": model.prefix,
+        "independent_vars": sorted(model.independent_vars),
+        "param_hints": {k: sorted(v.items()) for k, v in sorted(model.param_hints.items())},
+        "opts": sorted((k, repr(v)) for k, v in model.opts.items()),
+    }
+
+
+def _array_digest(arr):
+    arr = np.ascontiguousarray(arr, dtype=float)
+    return hashlib.sha256(arr.tobytes()).hexdigest() + str(arr.shape)
+
+
+class FitCache:
+    """
+    Persistent, content addressed store of fit results.
+
+    Each entry is keyed by a hash of the data arrays, the component models (including the bytecode of their
+    line shape functions, so editing one doesn't bring back its old results), the starting parameter values and
+    bounds, the fit options and CACHE_VERSION, and holds the JSON summary of the ModelResult - best_fit and the residual are
+    recomputed from the stored parameters on a hit. When the directory grows past max_bytes the least recently
+    used entries are removed.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 ** 2):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(x, data, weights, fitting_model: lmfit.Model, parameters: lmfit.Parameters, **fit_kws):
+        key = {
+            "version": CACHE_VERSION,
+            "x": _array_digest(x),
+            "data": _array_digest(data),
+            "weights": None if weights is None else _array_digest(weights),
+            "models": [_model_signature(m) for m in fitting_model.components],
+            "params": [(n, repr(p.value), repr(p.min), repr(p.max), p.vary, p.expr)
+                       for n, p in sorted(parameters.items())],
+            "fit_kws": sorted((k, repr(v)) for k, v in fit_kws.items()),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get_summary(self, key):
+        """
+        The stored ModelResult.summary() for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'r') as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(path)  # mark as recently used
+        self.hits += 1
+        return summary
+
+    def get(self, key, fitting_model: lmfit.Model, x, data, weights=None, **eval_kws):
+        """
+        Rebuild the cached ModelResult for key, or return None on a miss.
+        """
+        summary = self.get_summary(key)
+        if summary is None:
+            return None
+
+        params = lmfit.Parameters()
+        for state in summary["params"]:
+            par = lmfit.Parameter(state[0])
+            par.__setstate__(tuple(state))
+            params.add(par)
+        params.update_constraints()
+
+        result = lmfit.model.ModelResult(fitting_model, params, data=data, weights=weights)
+        result.params = params
+        # make_params adds the hint parameters to the model's param_names, with a single component that is the
+        # component's own model, whose later fits would then ask for them
+        result.init_params = copy.deepcopy(fitting_model).make_params(**summary["init_values"])
+        for attr in ("method", "ndata", "nvarys", "nfree", "chisqr", "redchi", "aic", "bic", "rsquared", "nfev",
+                     "errorbars", "success", "message", "var_names", "init_values", "best_values"):
+            setattr(result, attr, summary.get(attr))
+        result.userkws = {"x": x, **eval_kws}
+        result.init_fit = fitting_model.eval(params=result.init_params, x=x, **eval_kws)
+        result.best_fit = fitting_model.eval(params=params, x=x, **eval_kws)
+        result.residual = result.best_fit - data if weights is None else (result.best_fit - data) * weights
+        return result
+
+    def put(self, key, result: lmfit.model.ModelResult):
+        self.put_summary(key, result.summary())
+
+    def put_summary(self, key, summary):
+        """
+        Store a ModelResult.summary(), e.g. one sent back by a worker process that can't return the result itself.
+        """
+        with open(self._path(key), 'w') as f:
+            json.dump(summary, f, default=str)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(e[1] for e in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        sizes = [os.path.getsize(os.path.join(self.directory, n))
+                 for n in os.listdir(self.directory) if n.endswith(".json")]
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(sizes), "bytes": sum(sizes)}
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    The cache shared by the GUI, stored in the user's cache directory.
+    """
+    global _default_cache
+    if _default_cache is None:
+        if os.name == "nt":
+            base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        else:
+            base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        _default_cache = FitCache(os.path.join(base, "XPyS", "fits"))
+    return _default_cache
@@ -0,0 +1,137 @@
+import copy
+from dataclasses import dataclass, field
+
+import numpy as np
+import scipy.sparse
+from scipy.optimize import least_squares
+
+import Constraints
+import MoreModels
+
+
+@dataclass
+class GlobalFitResult:
+    shared_values: dict
+    spectrum_values: list  # one dict of all parameter values per spectrum
+    params: list  # one lmfit.Parameters per spectrum
+    best_fits: list
+    chisqr: float
+    nfev: int
+    success: bool
+    message: str
+    n_shared: int = 0
+    n_per_spectrum: int = 0
+    residuals: list = field(default_factory=list)
+
+    @property
+    def redchi(self):
+        ndata = sum(len(r) for r in self.residuals)
+        nfree = ndata - self.n_shared - self.n_per_spectrum * len(self.residuals)
+        return self.chisqr / max(nfree, 1)
+
+
+def _is_shared(name, prefixes, shared):
+    if name in shared:
+        return True
+    for prefix in prefixes:
+        if prefix and name.startswith(prefix) and name.removeprefix(prefix) in shared:
+            return True
+    return False
+
+
+def global_fit(spectra, models, shared=("sigma", "sigma_r", "gamma", "gaussian_sigma"), max_nfev=None):
+    """
+    Fit the same set of components to several spectra at once, with some parameters shared by all spectra.
+
+    All spectra are stacked into one residual vector. A parameter is shared if its full name, or its name
+    without the component prefix, is in shared - the rest get an independent copy per spectrum. Because the
+    residual of one spectrum only depends on the shared parameters and that spectrum's own ones, the Jacobian
+    is block sparse; its sparsity is passed to the solver so the finite differences of all per-spectrum blocks
+    are taken together and the cost grows roughly linearly with the number of spectra.
+
+    :param spectra: list of (x, y) pairs, the x arrays can differ
+    :param models: list of Components giving the components and the starting values and bounds
+    :param shared: parameter names (with or without prefix) to share between spectra
+    :returns: GlobalFitResult
+    """
+    if len(spectra) == 0:
+        raise ValueError("Need at least one spectrum to fit")
+    fitting_model, start_params = MoreModels.build_fitting_model(models)
+    template = MoreModels.full_parameters(fitting_model, start_params)
+
+    prefixes = [m.prefix for m in fitting_model.components]
+    free = [n for n, p in template.items() if p.vary and p.expr is None]
+    shared_names = [n for n in free if _is_shared(n, prefixes, shared)]
+    local_names = [n for n in free if n not in shared_names]
+    n_shared, n_local, n_spectra = len(shared_names), len(local_names), len(spectra)
+
+    spectra = [(np.asarray(x, dtype=float), np.asarray(y, dtype=float)) for x, y in spectra]
+    weights = [1 / np.sqrt(y) for _, y in spectra]
+    spectrum_params = [copy.deepcopy(template) for _ in spectra]
+
+    # every parameter of every spectrum as one (n_spectra, n_params) array, the constraints computed on all rows
+    # at once and the components called directly, so the fit loop never goes through lmfit's expression evaluator
+    names = list(template.keys())
+    index = {n: i for i, n in enumerate(names)}
+    constraints = Constraints.ConstraintSet.from_parameters(template)
+    values = np.tile([p.value for p in template.values()], (n_spectra, 1))
+    shared_columns = [index[n] for n in shared_names]
+    local_columns = [index[n] for n in local_names]
+    arguments = [(model, [(n.removeprefix(model.prefix), index[n])
+                          for n in MoreModels.function_arguments(model) if n in index])
+                 for model in fitting_model.components]
+
+    def set_values(vector):
+        values[:, shared_columns] = vector[:n_shared]
+        values[:, local_columns] = vector[n_shared:].reshape(n_spectra, n_local)
+        constraints.apply(values)
+
+    def evaluate(row, x, y):
+        total = np.zeros_like(x)
+        for model, args in arguments:
+            kwargs = {arg: row[i] for arg, i in args}
+            kwargs.update(model.opts)
+            if 'y' in model.independent_vars:
+                kwargs['y'] = y
+            total += model.func(x, **kwargs)
+        return total
+
+    def residual(vector):
+        set_values(vector)
+        return np.concatenate([(evaluate(row, x, y) - y) * w for row, (x, y), w in zip(values, spectra, weights)])
+
+    x0 = np.array([template[n].value for n in shared_names] + [template[n].value for n in local_names] * n_spectra)
+    lower = np.array([template[n].min for n in shared_names] + [template[n].min for n in local_names] * n_spectra)
+    upper = np.array([template[n].max for n in shared_names] + [template[n].max for n in local_names] * n_spectra)
+    x0 = np.clip(x0, lower, upper)
+
+    # rows of spectrum i depend on the shared columns and on the i-th block of per-spectrum columns
+    sparsity = scipy.sparse.lil_matrix((sum(len(x) for x, _ in spectra), len(x0)), dtype=int)
+    row = 0
+    for i, (x, _) in enumerate(spectra):
+        sparsity[row:row + len(x), :n_shared] = 1
+        sparsity[row:row + len(x), n_shared + i * n_local:n_shared + (i + 1) * n_local] = 1
+        row += len(x)
+
+    solution = least_squares(residual, x0, bounds=(lower, upper), jac_sparsity=sparsity, x_scale='jac',
+                             max_nfev=max_nfev)
+    set_values(solution.x)
+    for params, row in zip(spectrum_params, values):
+        for name, value in zip(names, row):
+            if params[name].expr is None:
+                params[name].value = value
+
+    best_fits = [fitting_model.eval(params, x=x, y=y) for params, (x, y) in zip(spectrum_params, spectra)]
+    return GlobalFitResult(
+        shared_values={n: solution.x[i] for i, n in enumerate(shared_names)},
+        spectrum_values=[params.valuesdict() for params in spectrum_params],
+        params=spectrum_params,
+        best_fits=best_fits,
+        chisqr=float(np.sum(solution.fun ** 2)),
+        nfev=solution.nfev,
+        success=solution.success,
+        message=solution.message,
+        n_shared=n_shared,
+        n_per_spectrum=n_local,
+        residuals=[y - best for (_, y), best in zip(spectra, best_fits)],
+    )
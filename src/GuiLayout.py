@@ -1,20 +1,29 @@
 import math
 import os.path
 
-import lmfit
-import scipy.signal as signal
-import matplotlib.pyplot as plt
 import numpy as np
+from PyQt6.QtCore import QTimer
 from PyQt6.QtGui import QAction, QKeySequence
-from PyQt6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout
+from PyQt6.QtWidgets import (
+    QMainWindow, QWidget, QVBoxLayout, QMessageBox, QDialog, QComboBox, QLabel, QProgressDialog
+)
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+import BlitRenderer
+import BootstrapWorker
 import CustomWidgets
 import DataImport
-import MoreModels
-import PeakSelector
-import PeakGuessing
+import Decimation
+import PreviewWorker
+import RegionOfInterest
+import RenderScheduler
+import Workspace
+
+# lmfit, scipy and the modules built on them take most of the start up time, so they are imported where they are
+# first needed (XPyS.py preloads them in the background once the window is up)
+PRELOAD_MODULES = ("lmfit", "MoreModels", "PeakGuessing", "PeakSelector", "FitCache", "ModelSelection", "Bootstrap",
+                   "matplotlib.widgets")
 
 
 class PeakFitter(QMainWindow):
@@ -22,13 +31,50 @@ class PeakFitter(QMainWindow):
         super().__init__()
         self.setWindowTitle("Peak Fitting App")
 
+        # every spectrum opened, x/y/roi/components below belong to the active one
+        self.workspace = Workspace.Workspace()
+
         self.x = np.array([])
         self.y = np.array([])
         self.err_bars = np.array([])
 
+        # the points fitted, the stretch of x/y spanned by the region of interest. Points in it the region leaves
+        # out (fit_mask False) stay on the grid with zero weight
+        self.roi = RegionOfInterest.RegionOfInterest()
+        self.fit_x = self.x
+        self.fit_y = self.y
+        self.fit_mask = np.ones(self.x.shape, dtype=bool)
+        self._span_selector = None
+
+        # what is drawn of fit_x/fit_y, decimated for large spectra; fitting always uses the full arrays
+        self.decimator = Decimation.DisplayDecimator()
+        self.display_index = None  # indices into fit_x, None draws every point
+        self.data_line = None
+        # the points outside the region of interest, drawn greyed out and decimated the same way
+        self.excluded_decimator = Decimation.DisplayDecimator()
+        self.excluded_index = None
+        self.excluded_line = None
+        self._redecimate_pending = False
+
+        # optional finer grid the component lines are drawn on, with y interpolated for y dependent models
+        self.preview_x = None
+        self.preview_y = None
+
         self.components = {}
+        self.render_scheduler = RenderScheduler.RenderScheduler(self.update_components, parent=self)
+        self.preview_evaluator = PreviewWorker.PreviewEvaluator(parent=self)
+        self.preview_evaluator.ready.connect(self.on_preview_ready)
+        self.bootstrap_runner = BootstrapWorker.BootstrapRunner(parent=self)
+        self.bootstrap_runner.finished.connect(self.on_uncertainties_ready)
+        self.bootstrap_runner.failed.connect(self.on_uncertainties_failed)
+        self.bootstrap_progress = None
 
         self.init_ui()
+        # render timings get their own corner of the status bar, so every frame doesn't overwrite the messages
+        # of fits and other actions
+        self.render_stats_label = QLabel()
+        self.statusBar().addPermanentWidget(self.render_stats_label)
+        self.render_scheduler.rendered.connect(self.show_render_stats)
 
     def init_ui(self):
         # === Central Widget ===
@@ -36,8 +82,12 @@ class PeakFitter(QMainWindow):
         self.setCentralWidget(central_widget)
         layout = QVBoxLayout(central_widget)
 
+        self.spectrum_selector = QComboBox()
+        self.spectrum_selector.currentIndexChanged.connect(self.activate_spectrum)
+        layout.addWidget(self.spectrum_selector)
+
         # === Matplotlib Canvas ===
-        self.figure = plt.figure()
+        self.figure = Figure()
 
         # Use GridSpec to create subplots
         grid = self.figure.add_gridspec(2, 1, height_ratios=[1, 5])
@@ -45,16 +95,27 @@ class PeakFitter(QMainWindow):
         self.ax2 = self.figure.add_subplot(grid[0], sharex=self.ax)  # Smaller axes (on top) for residuals
         self.ax2.xaxis.set_visible(False)  # Hide x-axis for the smaller plot
         self.ax2.axhline(y=0, color='r', linestyle='--', linewidth=1)  # indicate y=0 line for residuals
-        plt.subplots_adjust(hspace=0.0)  # Reduce vertical gap between subplots
+        self.residual_line = self.ax2.plot([], [], 'k-')[0]
+        self.rmse_text = self.ax2.text(0.05, 0.95, "", transform=self.ax2.transAxes, fontsize=14, ha='left',
+                                       va='top', color='blue')
+        self.figure.subplots_adjust(hspace=0.0)  # Reduce vertical gap between subplots
         self.canvas = FigureCanvas(self.figure)
         layout.addWidget(self.canvas)
+        self.renderer = BlitRenderer.BlitRenderer(self.canvas)
 
         self.model_lines = {}
         self.residuals = np.ndarray([])
+        # running sum of the components, and the curve each one currently contributes to it
+        self.envelope_y = np.zeros_like(self.fit_x)
+        self.component_y = {}
+        # the same on the preview grid, if there is one
+        self.preview_envelope = None
+        self.component_preview = {}
 
         # === Model Params Layout ===
-        self.model_params_layout = QHBoxLayout()
-        layout.addLayout(self.model_params_layout)
+        self.component_panel = CustomWidgets.QComponentPanel()
+        self.component_panel.setMaximumHeight(250)
+        layout.addWidget(self.component_panel)
 
         # === Menu ===
         menubar = self.menuBar()
@@ -71,57 +132,116 @@ class PeakFitter(QMainWindow):
         add_peak_action.triggered.connect(self.create_model)
         spectrum_menu.addAction(add_peak_action)
 
+        auto_select_action = QAction("Auto Select Components...", self)
+        auto_select_action.triggered.connect(self.auto_select_components)
+        spectrum_menu.addAction(auto_select_action)
+
         optimise_action = QAction("Optimise Parameters", self)
         optimise_action.setShortcut("Ctrl+Shift+O")
         optimise_action.triggered.connect(self.optimise)
         spectrum_menu.addAction(optimise_action)
 
+        self.multi_resolution_action = QAction("Multi-resolution Fit", self)
+        self.multi_resolution_action.setCheckable(True)
+        spectrum_menu.addAction(self.multi_resolution_action)
+
+        self.fine_preview_action = QAction("Fine Component Preview", self)
+        self.fine_preview_action.setCheckable(True)
+        self.fine_preview_action.toggled.connect(lambda checked: self.update_fit_region())
+        spectrum_menu.addAction(self.fine_preview_action)
+
+        panel_benchmark_action = QAction("Time Parameter Panel Construction", self)
+        panel_benchmark_action.triggered.connect(self.benchmark_component_panel)
+        spectrum_menu.addAction(panel_benchmark_action)
+
+        benchmark_action = QAction("Compare Multi-resolution Speed", self)
+        benchmark_action.triggered.connect(self.benchmark_multi_resolution)
+        spectrum_menu.addAction(benchmark_action)
+
+        uncertainty_action = QAction("Estimate Uncertainties...", self)
+        uncertainty_action.triggered.connect(self.estimate_uncertainties)
+        spectrum_menu.addAction(uncertainty_action)
+
+        regions_menu = spectrum_menu.addMenu("Regions")
+        window_action = QAction("Add Fit Window", self)
+        window_action.triggered.connect(lambda: self.select_region(self.roi.add_window, 'g'))
+        regions_menu.addAction(window_action)
+
+        exclude_action = QAction("Exclude Range", self)
+        exclude_action.triggered.connect(lambda: self.select_region(self.roi.add_exclusion, 'r'))
+        regions_menu.addAction(exclude_action)
+
+        clear_regions_action = QAction("Clear Regions", self)
+        clear_regions_action.triggered.connect(self.clear_regions)
+        regions_menu.addAction(clear_regions_action)
+
+    def closeEvent(self, event):
+        self.preview_evaluator.stop()
+        self.bootstrap_runner.stop()
+        super().closeEvent(event)
+
     def create_model(self):
+        import PeakSelector
         popup = PeakSelector.PeakSelector(self.components.keys())
         popup.data_signal.connect(self.add_model)
+        popup.models_signal.connect(self.add_models)
         popup.exec()
 
-    def add_model(self, model: lmfit.Model):
-        dm = CustomWidgets.PeakDataModel(model)
-        group = CustomWidgets.QModelParamGroup(dm)
-        group.paramChanged.connect(self.update_plot)
-        group.request_deletion.connect(self.delete_model)
-
+    def add_models(self, models: list):
+        import PeakGuessing
         if (len(self.residuals) == 0) or (self.residuals is None):
-            self.residuals = self.y
-
-        self.components[model.prefix] = group       # TODO: stop emitting signals to plot in set_param_directly
-        self.model_params_layout.addWidget(group)
+            self.residuals = self.fit_y
+        # one guess for all the new peaks, tallest first
+        guesses = PeakGuessing.ranked_guesses(self.fit_x, self.residuals, k=len(models))
+        for i, model in enumerate(models):
+            self.add_model(model, guesses[i] if i < len(guesses) else (0, 0, 0, 0), expanded=False)
 
-        height, pos, w_left, w_right = PeakGuessing.best_guess(self.x, self.residuals)
-        if height > 0:
-            param_names = group.data_model.get_all_params().keys()
-            if any(["amplitude" in p for p in param_names]):
-                group.set_param_directly(model.prefix + "amplitude", CustomWidgets.BoundedValue(height, 0, height * 2))
+    def add_component(self, model: "lmfit.Model", expanded=False):
+        dm = CustomWidgets.PeakDataModel(model)
+        group = CustomWidgets.QModelParamGroup(dm, scheduler=self.render_scheduler, expanded=expanded)
+        group.paramChanged.connect(self.render_scheduler.request_render)
+        group.request_deletion.connect(self.delete_model)
+        self.components[model.prefix] = group
+        self.component_panel.add_group(group)
+        return group
 
-            if any(["sigma" in p for p in param_names]):
-                group.set_param_directly(model.prefix + "sigma",
-                                         CustomWidgets.BoundedValue(w_left, 0, max(w_left, w_right) * 2))
+    def add_model(self, model: "lmfit.Model", guess=None, expanded=True):
+        import PeakGuessing
+        group = self.add_component(model, expanded)
 
-            if any(["sigma" in p for p in param_names]):
-                group.set_param_directly(model.prefix + "sigma_r",
-                                         CustomWidgets.BoundedValue(w_right, 0, max(w_left, w_right) * 2))
+        if (len(self.residuals) == 0) or (self.residuals is None):
+            self.residuals = self.fit_y
 
-            if any(["center" in p for p in param_names]):
-                group.set_param_directly(model.prefix + "center",
-                                         CustomWidgets.BoundedValue(pos, np.min(self.x), np.max(self.x)))
-        self.update_plot(model.prefix)
+        if guess is None:
+            guess = PeakGuessing.best_guess(self.fit_x, self.residuals)
+        seeds = PeakGuessing.seed_from_guess(model.prefix, group.data_model.get_all_params().keys(), guess, self.fit_x,
+                                             model)
+        group.set_params_directly({name: CustomWidgets.BoundedValue.from_slider_dict(seed)
+                                   for name, seed in seeds.items()})
+        # drawn with the next frame, together with anything else that changed
+        self.render_scheduler.request_render(model.prefix)
 
     def slider_changed(self, group, idx, value, callback):
         getattr(self, group.lower())[idx] = value
         callback()
 
-    def delete_model(self, name):
-        if name not in self.components.keys():
-            raise ValueError(f"{name} not in self.components")
+    def remove_component_widget(self, name):
         model_to_delete = self.components.pop(name)
+        self.render_scheduler.discard(name)
+        self.preview_evaluator.forget(name)
         model_to_delete.hide()
         model_to_delete.deleteLater()
+
+    def delete_model(self, name):
+        if name not in self.components.keys():
+            raise ValueError(f"{name} not in self.components")
+        self.remove_component_widget(name)
+        removed = self.component_y.pop(name, None)
+        if removed is not None:
+            self.envelope_y -= removed
+        removed = self.component_preview.pop(name, None)
+        if removed is not None:
+            self.preview_envelope -= removed
         self.update_plot()
 
     def open_file(self):
@@ -150,9 +270,92 @@ class PeakFitter(QMainWindow):
             data = DataImport.load_specslab_xy(filepath)
             self.err_bars = None
 
-            self.x = data[:, 0]
-            self.y = data[:, 1]
-            self.update_plot()
+            index = self.workspace.add_spectrum(os.path.basename(filepath), data[:, 0], data[:, 1])
+            self.spectrum_selector.blockSignals(True)
+            self.spectrum_selector.addItem(self.workspace.spectra[index].name)
+            self.spectrum_selector.setCurrentIndex(index)
+            self.spectrum_selector.blockSignals(False)
+            self.activate_spectrum(index)
+
+    def activate_spectrum(self, index):
+        """
+        Switch to another spectrum of the workspace. The components of the one being left are stored as plain
+        ComponentStates and their widgets destroyed, the new one's widgets are built from its states.
+        """
+        if index < 0 or index == self.workspace.active:
+            return
+        current = self.workspace.active_spectrum()
+        if current is not None:
+            current.roi = self.roi
+            current.components = self.workspace.snapshot([g.data_model for g in self.components.values()])
+        for name in list(self.components):
+            self.remove_component_widget(name)
+
+        self.workspace.active = index
+        spectrum = self.workspace.spectra[index]
+        self.x = spectrum.x
+        self.y = spectrum.y
+        self.roi = spectrum.roi
+        self.residuals = np.ndarray([])
+        for state in spectrum.components:
+            self.add_component(state.model).set_params_directly(state.params)
+        self.update_fit_region()
+
+    def select_region(self, add_region, colour):
+        """
+        Let the user drag out an energy range on the plot and pass it to add_region.
+        """
+        if self.x.size == 0:
+            return
+        from matplotlib.widgets import SpanSelector
+
+        def on_select(low, high):
+            self._span_selector.set_active(False)
+            self._span_selector = None
+            if low == high:
+                return
+            previous = (list(self.roi.windows), list(self.roi.exclusions))
+            add_region(low, high)
+            if np.count_nonzero(self.roi.mask(self.x)) < 2:
+                self.roi.windows, self.roi.exclusions = previous
+                QMessageBox.warning(self, "Invalid Region", "The fit region needs to contain at least two points.")
+                return
+            self.update_fit_region()
+
+        self._span_selector = SpanSelector(self.ax, on_select, 'horizontal', useblit=True,
+                                           props=dict(alpha=0.2, facecolor=colour))
+
+    def clear_regions(self):
+        self.roi.clear()
+        self.update_fit_region()
+
+    def update_fit_region(self):
+        mask = self.roi.mask(self.x)
+        span = self.roi.span(self.x)
+        self.fit_x = self.x[span]
+        self.fit_y = self.y[span]
+        self.fit_mask = mask[span]
+        self.decimator.set_data(self.fit_x, self.fit_y)
+        self.excluded_decimator.set_data(self.x[~mask], self.y[~mask])
+        self.update_preview_grid()
+        self.update_plot()
+
+    preview_oversampling = 4
+
+    def update_preview_grid(self):
+        """
+        Set up the fine preview grid for the current fit region, or remove it. Spectra long enough to be decimated
+        for display are already finer than the screen, so they don't get one.
+        """
+        n = self.fit_x.size
+        if not self.fine_preview_action.isChecked() or n < 2 or n > self.decimator.threshold:
+            self.preview_x = None
+            self.preview_y = None
+            return
+        # evenly between neighbouring points, so uneven steps and either direction of x are fine
+        steps = np.linspace(0, n - 1, (n - 1) * self.preview_oversampling + 1)
+        self.preview_x = np.interp(steps, np.arange(n), self.fit_x)
+        self.preview_y = np.interp(steps, np.arange(n), self.fit_y)
 
     def update_plot(self, name=""):
         if self.x.size == 0:
@@ -160,62 +363,329 @@ class PeakFitter(QMainWindow):
 
         if name == "":
             self.ax.clear()
-            self.ax.plot(self.x, self.y, 'kx', label="Data")
+            self.excluded_line = None
+            if self.roi:
+                self.excluded_index = self.excluded_decimator.indices(self.ax.get_xlim(), self.ax.bbox.width)
+                self.excluded_line = self.ax.plot(*self.displayed_excluded(), 'x', color='lightgray')[0]
+                for low, high in self.roi.windows:
+                    self.ax.axvspan(low, high, color='g', alpha=0.05)
+                for low, high in self.roi.exclusions:
+                    self.ax.axvspan(low, high, color='r', alpha=0.1)
+            self.display_index = self.decimator.indices((np.min(self.fit_x), np.max(self.fit_x)),
+                                                        self.ax.bbox.width)
+            self.data_line = self.ax.plot(self.displayed(self.fit_x), self.displayed(self.selected_y()), 'kx',
+                                          label="Data")[0]
+            # clearing the axes drops their callbacks
+            self.ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
             self.model_lines = {}
+            # start the running sum again, so rounding errors don't build up and fit_x changes are picked up
+            self.envelope_y = np.zeros_like(self.fit_x)
+            self.component_y = {}
+            self.preview_envelope = None if self.preview_x is None else np.zeros_like(self.preview_x)
+            self.component_preview = {}
             for model in self.components.values():
                 assert isinstance(model, CustomWidgets.QModelParamGroup)
                 self.plot_peak_model(model.data_model)
         else:
+            self.update_components([name])
+            return
+
+        self.residuals = self.fit_y - self.plot_envelope()
+        self.plot_residuals()
+
+        self.ax.legend()
+        self.renderer.set_artists(self.animated_artists())
+
+    def update_components(self, names):
+        """
+        Redraw only the named components, then the envelope and residuals once. Unless a new line was added or
+        the residual axes had to rescale, only the lines are blitted onto the cached background.
+        """
+        if self.x.size == 0:
+            return
+
+        new_line = False
+        for name in names:
             model = self.components.get(name)
             if model is None:
                 raise ValueError(f"{name} not a recognised peak model")
+            new_line |= name not in self.model_lines
             self.plot_peak_model(model.data_model)
 
-        self.residuals = self.y - self.plot_envelope()
-        self.plot_residuals()
+        self.residuals = self.fit_y - self.plot_envelope()
+        rescaled = self.plot_residuals(rescale=False)
 
-        self.ax.legend()
-        self.canvas.draw_idle()
+        if new_line:
+            self.ax.legend()
+            self.renderer.set_artists(self.animated_artists())
+        elif rescaled:
+            self.renderer.invalidate()
+        else:
+            self.renderer.update()
+
+    def animated_artists(self):
+        return list(self.model_lines.values()) + [self.residual_line, self.rmse_text]
+
+    def show_render_stats(self, stats):
+        self.render_stats_label.setText(f"Render {stats['last_render_time'] * 1000:.1f} ms "
+                                        f"(mean {stats['mean_render_time'] * 1000:.1f} ms), "
+                                        f"{stats['dropped']} of {stats['submitted']} slider updates coalesced, "
+                                        f"blit {self.renderer.stats()['last_frame_time'] * 1000:.1f} ms, "
+                                        f"{self.preview_evaluator.dropped} stale previews dropped")
+
+    @staticmethod
+    def replace_contribution(curves, total, name, new_y):
+        previous = curves.get(name)
+        if previous is not None:
+            total -= previous
+        total += new_y
+        curves[name] = new_y
+
+    def component_curve(self, peak_model, curves, preview=False):
+        """
+        The component on the fit or preview grid. Slow components are evaluated in the background, until the
+        result is back the curve drawn last is kept (on_preview_ready redraws the component when it arrives).
+        """
+        x = self.preview_x if preview else self.fit_x
+        kwargs = self.eval_kwargs(peak_model, preview)
+        model_y = self.preview_evaluator.evaluate(peak_model, x, **kwargs)
+        if model_y is None:
+            model_y = curves.get(peak_model.get_name())
+        if model_y is None:
+            # nothing drawn yet to keep showing
+            model_y = peak_model.evaluate(x, **kwargs)
+        return model_y
+
+    def on_preview_ready(self, name):
+        if name in self.components:
+            self.render_scheduler.request_render(name)
 
     def plot_peak_model(self, peak_model):
         peak_name = peak_model.get_name()
-        model_y = peak_model.evaluate(self.x, y=self.y)  # TODO: options for finer x to look prettier?
+        model_y = self.component_curve(peak_model, self.component_y)
+        self.replace_contribution(self.component_y, self.envelope_y, peak_name, model_y)
+        if self.preview_x is None:
+            line_x, line_y = self.displayed(self.fit_x), self.displayed(model_y)
+        else:
+            line_x = self.preview_x
+            line_y = self.component_curve(peak_model, self.component_preview, preview=True)
+            self.replace_contribution(self.component_preview, self.preview_envelope, peak_name, line_y)
         if peak_name in self.model_lines.keys():
-            self.model_lines[peak_name].set_xdata(self.x)
-            self.model_lines[peak_name].set_ydata(model_y)
+            self.model_lines[peak_name].set_data(line_x, line_y)
         else:
-            self.model_lines[peak_name] = self.ax.plot(self.x, model_y, label=peak_name.title())[0]
+            self.model_lines[peak_name] = self.ax.plot(line_x, line_y, label=peak_name.title())[0]
+
+    def displayed(self, arr):
+        return arr if self.display_index is None else arr[self.display_index]
+
+    def selected_y(self):
+        # the left out points inside the fit region are drawn greyed out with the others, not as data
+        return np.where(self.fit_mask, self.fit_y, np.nan)
+
+    def displayed_excluded(self):
+        x, y = self.excluded_decimator.x, self.excluded_decimator.y
+        if self.excluded_index is None:
+            return x, y
+        return x[self.excluded_index], y[self.excluded_index]
+
+    def on_xlim_changed(self, ax):
+        # panning fires this for every mouse move, pick the points to draw once things settle
+        if not self._redecimate_pending:
+            self._redecimate_pending = True
+            QTimer.singleShot(0, self.redecimate)
+
+    def redecimate(self):
+        """
+        Redraw every line with the points picked for the current view and canvas width.
+        """
+        self._redecimate_pending = False
+        if self.data_line is None or self.fit_x.size == 0:
+            return
+        changed = False
+        if self.excluded_line is not None:
+            excluded_index = self.excluded_decimator.indices(self.ax.get_xlim(), self.ax.bbox.width)
+            if excluded_index is not self.excluded_index:
+                self.excluded_index = excluded_index
+                self.excluded_line.set_data(*self.displayed_excluded())
+                changed = True
+        index = self.decimator.indices(self.ax.get_xlim(), self.ax.bbox.width)
+        if index is self.display_index:
+            if changed:
+                self.renderer.invalidate()
+            return
+        self.display_index = index
+        x = self.displayed(self.fit_x)
+        self.data_line.set_data(x, self.displayed(self.selected_y()))
+        if self.preview_x is None:
+            for name, component_y in self.component_y.items():
+                self.model_lines[name].set_data(x, self.displayed(component_y))
+            self.model_lines["Envelope"].set_data(x, self.displayed(self.envelope_y))
+        self.residual_line.set_data(x, self.displayed(self.residuals))
+        self.renderer.invalidate()
+
+    def eval_kwargs(self, peak_model, preview=False):
+        # the same arguments on every call, so the component's cached evaluation can be reused
+        if 'y' not in peak_model.eval_requirements():
+            return {}
+        return {'y': self.preview_y if preview else self.fit_y}
 
     def plot_envelope(self):
-        envelope_y = np.zeros_like(self.x)
-        for model in self.components.values():
-            needs_y = 'y' in model.data_model.eval_requirements()
-            temp_kwargs = {'y': self.y} if needs_y else {}
-            envelope_y += model.data_model.evaluate(self.x, **temp_kwargs)
+        envelope_y = self.envelope_y
+        if self.preview_x is None:
+            line_x, line_y = self.displayed(self.fit_x), self.displayed(envelope_y)
+        else:
+            line_x, line_y = self.preview_x, self.preview_envelope
         if "Envelope" in self.model_lines:
-            self.model_lines["Envelope"].set_xdata(self.x)
-            self.model_lines["Envelope"].set_ydata(envelope_y)
+            self.model_lines["Envelope"].set_data(line_x, line_y)
         else:
-            self.model_lines["Envelope"] = self.ax.plot(self.x, envelope_y, label="Envelope")[0]
+            self.model_lines["Envelope"] = self.ax.plot(line_x, line_y, label="Envelope")[0]
 
         return envelope_y
 
-    def plot_residuals(self):
-        self.ax2.clear()
-        self.ax2.plot(self.x, self.residuals, 'k-')
+    def plot_residuals(self, rescale=True):
+        """
+        :param rescale: fit the residual axes to the residuals, otherwise only rescale if they no longer fit
+        :returns: whether the residual axes limits changed
+        """
+        self.residual_line.set_data(self.displayed(self.fit_x), self.displayed(self.residuals))
         residual_std = math.sqrt(np.sum(np.square(self.residuals))/len(self.residuals))
-        self.ax2.text(0.05, 0.95, f"RMSE = {residual_std:.4}", transform=self.ax2.transAxes,
-                 fontsize=14, ha='left', va='top', color='blue')
+        self.rmse_text.set_text(f"RMSE = {residual_std:.4}")
+        low, high = self.ax2.get_ylim()
+        if not rescale and low <= np.min(self.residuals) and np.max(self.residuals) <= high:
+            return False
+        self.ax2.relim()
+        self.ax2.autoscale_view(scalex=False)
+        return self.ax2.get_ylim() != (low, high)
 
     def optimise(self):
         if self.x.size == 0:
             return
+        import lmfit
+        import FitCache
+        import MoreModels
 
         models = [m.data_model for m in self.components.values()]
-        result = MoreModels.optimise_multiple_models(self.x, self.y, models)
+        cache = FitCache.default_cache()
+        coarse_factor = 4 if self.multi_resolution_action.isChecked() else None
+        try:
+            result = MoreModels.optimise_multiple_models(self.fit_x, self.fit_y, models, cache=cache,
+                                                         coarse_factor=coarse_factor, mask=self.fit_mask)
+        except (ValueError, ArithmeticError) as e:
+            QMessageBox.warning(self, "Fit Failed", str(e))
+            return
         assert isinstance(result, lmfit.model.ModelResult)
-        summary = result.summary()
+        stats = cache.stats()
+        message = f"Fit cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries"
+        timing = getattr(result, "multi_resolution", None)
+        if timing is not None:
+            message += (f" | coarse {timing['coarse_time'] * 1000:.0f} ms ({timing['coarse_nfev']} evals), "
+                        f"fine {timing['fine_time'] * 1000:.0f} ms ({timing['fine_nfev']} evals)")
+            if timing.get('coarse_error'):
+                message += " | coarse fit failed, fitted the full grid directly"
+        self.statusBar().showMessage(message)
+        self.apply_best_values(result.summary()["best_values"])
+
+    def apply_best_values(self, best_values):
+        # one batch per component, the scheduler then redraws them all in a single frame
         for pref, comp in self.components.items():
-            for k, v in summary["best_values"].items():
-                if k.startswith(pref):
-                    comp.set_param_directly(k, v)
+            comp.set_params_directly({k: v for k, v in best_values.items() if k.startswith(pref)})
+
+    def auto_select_components(self):
+        if self.x.size == 0:
+            return
+        import FitCache
+        import ModelSelection
+        import PeakSelector
+
+        popup = PeakSelector.PeakSelector(self.components.keys(), auto_select=True)
+        if popup.exec() != QDialog.DialogCode.Accepted:
+            return
+        model_factory = popup.implemented_models[popup.combobox.currentText()]
+        max_components = popup.count_spinbox.value()
+
+        base_models = [m.data_model for m in self.components.values()]
+        try:
+            selection = ModelSelection.select_model_order(self.fit_x, self.fit_y, model_factory, max_components,
+                                                          base_name=popup.curr_name, base_models=base_models,
+                                                          mask=self.fit_mask, cache=FitCache.default_cache())
+        except (NameError, ValueError, ArithmeticError) as e:
+            # e.g. lmfit refusing candidates whose parameter names run into an existing component's
+            QMessageBox.warning(self, "Auto Select Components", str(e))
+            return
+        for model in selection.components:
+            self.add_model(model, expanded=False)
+        self.apply_best_values(selection.best_values)
+        QMessageBox.information(self, "Auto Select Components", selection.report())
+
+    def estimate_uncertainties(self):
+        if self.x.size == 0 or len(self.components) == 0 or self.bootstrap_runner.running:
+            return
+        import FitCache
+        import MoreModels
+
+        # the best fit is found here, the resamples are refitted on the worker from this snapshot, so the
+        # components can be edited while it runs
+        models = [m.data_model for m in self.components.values()]
+        try:
+            best_result = MoreModels.optimise_multiple_models(self.fit_x, self.fit_y, models,
+                                                              cache=FitCache.default_cache(), mask=self.fit_mask)
+        except (ValueError, ArithmeticError) as e:
+            QMessageBox.warning(self, "Bootstrap Uncertainties", str(e))
+            return
+        n_samples = 500
+        self.bootstrap_progress = QProgressDialog("Refitting resampled spectra...", "Cancel", 0, n_samples, self)
+        self.bootstrap_progress.setWindowTitle("Bootstrap Uncertainties")
+        self.bootstrap_progress.setMinimumDuration(0)
+        self.bootstrap_progress.canceled.connect(self.bootstrap_runner.cancel)
+        self.bootstrap_runner.progress.connect(self.bootstrap_progress.setValue)
+        # refits of one spectrum are too short for worker processes to pay off, so they run serially
+        self.bootstrap_runner.start(np.array(self.fit_x), np.array(self.fit_y), models, n_samples=n_samples,
+                                    n_workers=1, best_result=best_result,
+                                    mask=np.array(self.fit_mask))
+
+    def _close_bootstrap_progress(self):
+        if self.bootstrap_progress is not None:
+            self.bootstrap_runner.progress.disconnect(self.bootstrap_progress.setValue)
+            self.bootstrap_progress.canceled.disconnect(self.bootstrap_runner.cancel)
+            self.bootstrap_progress.close()
+            self.bootstrap_progress.deleteLater()
+            self.bootstrap_progress = None
+
+    def on_uncertainties_ready(self, result):
+        self._close_bootstrap_progress()
+        if result.n_samples == 0:
+            QMessageBox.warning(self, "Bootstrap Uncertainties", "None of the resampled spectra could be refitted")
+            return
+        QMessageBox.information(self, "Bootstrap Uncertainties", result.report())
+
+    def on_uncertainties_failed(self, message):
+        self._close_bootstrap_progress()
+        QMessageBox.warning(self, "Bootstrap Uncertainties", message)
+
+    def benchmark_multi_resolution(self):
+        if self.x.size == 0 or len(self.components) == 0:
+            return
+        import MoreModels
+
+        models = [m.data_model for m in self.components.values()]
+        timing = MoreModels.benchmark_multi_resolution(self.fit_x, self.fit_y, models, mask=self.fit_mask)
+        QMessageBox.information(self, "Multi-resolution Fit",
+                                f"Direct fit: {timing['direct_time'] * 1000:.0f} ms, "
+                                f"{timing['direct_nfev']} evals, chi-square {timing['direct_chisqr']:.5g}\n"
+                                f"Coarse to fine: {timing['multi_resolution_time'] * 1000:.0f} ms, "
+                                f"{timing['multi_resolution_fine_nfev']} full grid evals, "
+                                f"chi-square {timing['multi_resolution_chisqr']:.5g}\n"
+                                f"Speedup: {timing['speedup']:.2f}x")
+
+    def benchmark_component_panel(self):
+        if len(self.components) == 0:
+            return
+
+        # fresh data models, so the throwaway groups don't connect to the real ones
+        models = [g.data_model.peak_model for g in self.components.values()]
+        eager = CustomWidgets.time_group_construction([CustomWidgets.PeakDataModel(m) for m in models], True)
+        lazy = CustomWidgets.time_group_construction([CustomWidgets.PeakDataModel(m) for m in models], False)
+        QMessageBox.information(self, "Parameter Panel",
+                                f"{len(models)} components\n"
+                                f"All sliders built: {eager * 1000:.1f} ms\n"
+                                f"Collapsed: {lazy * 1000:.1f} ms")
@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+
+import numpy as np
+import scipy.special
+from lmfit import lineshapes
+from scipy.signal import fftconvolve
+
+import Components
+import Constraints
+import MoreModels
+
+tiny = 1.0e-15
+s2pi = np.sqrt(2 * np.pi)
+
+
+# lmfit's lineshapes use the builtin max() to guard against zero widths, which fails on arrays of parameters.
+# These take parameters as (n_pixels, 1) columns and return (n_pixels, n_points).
+def _gaussian(x, amplitude=1.0, center=0.0, sigma=1.0):
+    sigma = np.maximum(tiny, sigma)
+    return amplitude / (s2pi * sigma) * np.exp(-(x - center) ** 2 / (2 * sigma ** 2))
+
+
+def _lorentzian(x, amplitude=1.0, center=0.0, sigma=1.0):
+    sigma = np.maximum(tiny, sigma)
+    return amplitude / (1 + ((x - center) / sigma) ** 2) / (np.pi * sigma)
+
+
+def _split_lorentzian(x, amplitude=1.0, center=0.0, sigma=1.0, sigma_r=1.0):
+    s = np.maximum(tiny, sigma)
+    r = np.maximum(tiny, sigma_r)
+    xc2 = (x - center) ** 2
+    amp = 2 * amplitude / (np.pi * (s + r))
+    return amp * (s * s * (x < center) / (s * s + xc2) + r * r * (x >= center) / (r * r + xc2))
+
+
+def _voigt(x, amplitude=1.0, center=0.0, sigma=1.0, gamma=None):
+    if gamma is None:
+        gamma = sigma
+    sigma = np.maximum(tiny, sigma)
+    z = (x - center + 1j * gamma) / (sigma * np.sqrt(2))
+    return amplitude * np.real(scipy.special.wofz(z)) / (sigma * s2pi)
+
+
+def _constant(x, c=0.0):
+    return c * np.ones_like(x)
+
+
+def _linear(x, slope=1.0, intercept=0.0):
+    return slope * x + intercept
+
+
+def _split_lorentz_conv_gauss(x, amplitude, center, sigma, sigma_r, gaussian_sigma):
+    # same padding and kernel orientation as lmfitxps.lineshapes.fft_convolve, one row per pixel
+    x_row = x[0]
+    is_binding_energy = x_row[-1] < x_row[0]
+    lorentz = _split_lorentzian(x, amplitude=1, center=center, sigma=sigma, sigma_r=sigma_r)
+    kernel = _gaussian(x, amplitude=1, center=np.mean(x_row), sigma=gaussian_sigma) / (s2pi * gaussian_sigma)
+    if is_binding_energy:
+        kernel = kernel[:, ::-1]
+    n = x_row.size
+    padded = np.concatenate((np.repeat(lorentz[:, :1], n, axis=1), lorentz,
+                             np.repeat(lorentz[:, -1:], n, axis=1)), axis=1)
+    out = fftconvolve(padded, kernel, mode='valid', axes=1)
+    start = int((out.shape[1] - n) / 2)
+    conv = out[:, start:start + n]
+    return amplitude * conv / np.max(conv, axis=1, keepdims=True)
+
+
+def _split_lorentz_conv_gauss_doublet(x, amplitude, center, sigma, sigma_r, gaussian_sigma, splitting, area_ratio):
+    # as _split_lorentz_conv_gauss with a (n_pixels, 2, n_points) stack of lines, one kernel per pixel for both
+    x_row = x[0]
+    is_binding_energy = x_row[-1] < x_row[0]
+    centers = np.stack((center, center + splitting), axis=1)
+    lines = _split_lorentzian(x[:, np.newaxis, :], amplitude=1, center=centers, sigma=sigma[:, np.newaxis],
+                              sigma_r=sigma_r[:, np.newaxis])
+    kernel = _gaussian(x, amplitude=1, center=np.mean(x_row), sigma=gaussian_sigma) / (s2pi * gaussian_sigma)
+    if is_binding_energy:
+        kernel = kernel[:, ::-1]
+    n = x_row.size
+    padded = np.concatenate((np.repeat(lines[:, :, :1], n, axis=2), lines,
+                             np.repeat(lines[:, :, -1:], n, axis=2)), axis=2)
+    out = fftconvolve(padded, kernel[:, np.newaxis, :], mode='valid', axes=2)
+    start = int((out.shape[2] - n) / 2)
+    conv = out[:, :, start:start + n]
+    conv = conv / np.max(conv, axis=2, keepdims=True)
+    return amplitude * (conv[:, 0] + area_ratio * conv[:, 1])
+
+
+def _voigt_doublet(x, amplitude=1.0, center=0.0, sigma=1.0, gamma=None, splitting=1.0, area_ratio=0.5):
+    if gamma is None:
+        gamma = sigma
+    sigma = np.maximum(tiny, sigma)
+    centers = np.stack((center, center + splitting), axis=1)
+    z = (x[:, np.newaxis, :] - centers + 1j * gamma[:, np.newaxis]) / (sigma[:, np.newaxis] * np.sqrt(2))
+    lines = np.real(scipy.special.wofz(z))
+    return amplitude * (lines[:, 0] + area_ratio * lines[:, 1]) / (sigma * s2pi)
+
+
+def _func_key(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+# keyed by qualified name, as some lmfit models (e.g. ConstantModel) define their function inside __init__
+BATCHED_LINESHAPES = {
+    _func_key(lineshapes.gaussian): _gaussian,
+    _func_key(lineshapes.lorentzian): _lorentzian,
+    _func_key(lineshapes.split_lorentzian): _split_lorentzian,
+    _func_key(lineshapes.voigt): _voigt,
+    _func_key(lineshapes.linear): _linear,
+    "lmfit.models.ConstantModel.__init__.<locals>.constant": _constant,
+    _func_key(MoreModels.split_lorentz_conv_gauss): _split_lorentz_conv_gauss,
+    _func_key(MoreModels.split_lorentz_conv_gauss_doublet): _split_lorentz_conv_gauss_doublet,
+    _func_key(MoreModels.voigt_doublet): _voigt_doublet,
+}
+
+@dataclass
+class MapFitResult:
+    param_names: list
+    values: np.ndarray  # (n_pixels, n_params) every parameter, including constrained ones
+    chisqr: np.ndarray
+    n_iterations: np.ndarray
+    converged: np.ndarray  # chi-square stopped improving by more than tol
+    stalled: np.ndarray  # gave up because no step small enough to be accepted improved chi-square
+    map_shape: tuple
+
+    def parameter_map(self, name):
+        return self.values[:, self.param_names.index(name)].reshape(self.map_shape)
+
+    def chisqr_map(self):
+        return self.chisqr.reshape(self.map_shape)
+
+
+class BatchedModel:
+    """
+    Evaluates a sum of components for many parameter sets at once on a shared energy grid.
+    """
+
+    def __init__(self, fitting_model, template):
+        self.components = fitting_model.components
+        self.template = template
+        self.param_names = list(template.keys())
+        self.free_names = [n for n, p in template.items() if p.vary and p.expr is None]
+        self._index = {n: i for i, n in enumerate(self.param_names)}
+        self._free_index = np.array([self._index[n] for n in self.free_names], dtype=int)
+        self._start = np.array([p.value for p in template.values()])
+        self._constraints = Constraints.ConstraintSet.from_parameters(template)
+
+    def full_values(self, free_values):
+        """
+        Expand (n, n_free) free parameters into (n, n_params), filling in the fixed and constrained ones.
+        """
+        values = np.tile(self._start, (free_values.shape[0], 1))
+        values[:, self._free_index] = free_values
+        return self._constraints.apply(values)
+
+    def evaluate(self, x, free_values, data):
+        values = self.full_values(free_values)
+        total = np.zeros((values.shape[0], x.size))
+        for model in self.components:
+            kwargs = {n.removeprefix(model.prefix): values[:, self._index[n]]
+                      for n in MoreModels.function_arguments(model) if n in self._index}
+            kwargs.update(model.opts)
+            batched = BATCHED_LINESHAPES.get(_func_key(model.func))
+            if batched is not None:
+                total += batched(x[np.newaxis, :], **{k: (v[:, np.newaxis] if isinstance(v, np.ndarray) else v)
+                                                      for k, v in kwargs.items()})
+                continue
+            # unknown lineshape, fall back to evaluating pixel by pixel
+            for row in range(values.shape[0]):
+                row_kwargs = {k: (v[row] if isinstance(v, np.ndarray) else v) for k, v in kwargs.items()}
+                if 'y' in model.independent_vars:
+                    row_kwargs['y'] = data[row]
+                total[row] += model.func(x, **row_kwargs)
+        return total
+
+
+def fit_map(x, data, models, init=None, max_iter=200, tol=1e-6, lambda_start=1e-3):
+    """
+    Fit one peak model to every spectrum of an XPS map with a batched Levenberg-Marquardt solver.
+
+    All pixels take LM steps together: the model and its forward difference Jacobian are evaluated as
+    (n_pixels, n_points) arrays, and the damped normal equations are solved as a stack of small systems.
+    Each pixel keeps its own damping, and pixels whose chi-square stops improving by more than tol (relative)
+    drop out of the active set as converged. Pixels where even heavily damped steps stop improving the fit drop
+    out as stalled instead, and those left after max_iter as neither. Steps are clipped to the parameter bounds.
+
+    :param x: shared energy grid, (n_points,)
+    :param data: (..., n_points) spectra, the leading dimensions are the map shape
+    :param models: list of Components giving the components and the starting values and bounds
+    :param init: optional (n_pixels, n_free) starting values, otherwise every pixel starts from the models
+    :returns: MapFitResult
+    """
+    x = np.asarray(x, dtype=float)
+    data = np.asarray(data, dtype=float)
+    map_shape = data.shape[:-1]
+    data = data.reshape(-1, x.size)
+    n_pixels = data.shape[0]
+    # pixel spectra often contain zero counts, so don't let the weights blow up
+    weights = 1 / np.sqrt(np.clip(data, 1, None))
+
+    fitting_model, parameters = MoreModels.build_fitting_model(models)
+    template = MoreModels.full_parameters(fitting_model, parameters)
+    batched = BatchedModel(fitting_model, template)
+    store = Components.ParameterStore.from_parameters(template, n_pixels)
+    free = store.columns(batched.free_names)
+    n_free = free.size
+    if init is not None:
+        store.set_values(np.reshape(init, (n_pixels, n_free)), columns=free)
+    else:
+        store.clamp()
+    lower = store.minima[0, free]
+    upper = store.maxima[0, free]
+    values = store.values[:, free]
+
+    def residuals(rows, trial):
+        return (batched.evaluate(x, trial, data[rows]) - data[rows]) * weights[rows]
+
+    current = residuals(np.arange(n_pixels), values)
+    chisqr = np.sum(current ** 2, axis=1)
+    damping = np.full(n_pixels, lambda_start)
+    n_iterations = np.zeros(n_pixels, dtype=int)
+    converged = np.zeros(n_pixels, dtype=bool)
+    stalled = np.zeros(n_pixels, dtype=bool)
+    jtj = np.zeros((n_pixels, n_free, n_free))
+    jtr = np.zeros((n_pixels, n_free))
+    stale = np.ones(n_pixels, dtype=bool)  # pixels that moved since their Jacobian was taken
+    active = np.arange(n_pixels)
+
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+
+        # forward difference Jacobian, one batched evaluation per free parameter. A rejected step leaves the
+        # pixel where it was, so its Jacobian is reused and only the damping changes
+        rows = active[stale[active]]
+        if rows.size:
+            p = values[rows]
+            r = current[rows]
+            jac = np.empty((rows.size, x.size, n_free))
+            for j in range(n_free):
+                step = 1e-6 * np.maximum(np.abs(p[:, j]), 1e-6)
+                # step backwards when the forward step would leave the bounds
+                step = np.where(p[:, j] + step > upper[j], -step, step)
+                shifted = p.copy()
+                shifted[:, j] += step
+                jac[:, :, j] = (residuals(rows, shifted) - r) / step[:, np.newaxis]
+            jtj[rows] = np.einsum('nmi,nmj->nij', jac, jac)
+            jtr[rows] = np.einsum('nmi,nm->ni', jac, r)
+            stale[rows] = False
+
+        diag = np.einsum('nii->ni', jtj[active])
+        damped = jtj[active] + (damping[active, np.newaxis] * (diag + 1e-12))[:, :, np.newaxis] * np.eye(n_free)
+        delta = np.linalg.solve(damped, -jtr[active][:, :, np.newaxis])[:, :, 0]
+
+        trial = np.clip(values[active] + delta, lower, upper)
+        trial_r = residuals(active, trial)
+        trial_chisqr = np.sum(trial_r ** 2, axis=1)
+        improved = trial_chisqr < chisqr[active]
+        n_iterations[active] += 1
+
+        relative_change = (chisqr[active] - trial_chisqr) / np.maximum(chisqr[active], tiny)
+        moved = active[improved]
+        values[moved] = trial[improved]
+        current[moved] = trial_r[improved]
+        chisqr[moved] = trial_chisqr[improved]
+        stale[moved] = True
+        damping[active] = np.where(improved, np.maximum(damping[active] / 10, 1e-12), damping[active] * 10)
+
+        done = improved & (relative_change < tol)
+        stuck = ~done & (damping[active] > 1e10)
+        converged[active[done]] = True
+        stalled[active[stuck]] = True
+        active = active[~(done | stuck)]
+
+    return MapFitResult(param_names=batched.param_names, values=batched.full_values(values), chisqr=chisqr,
+                        n_iterations=n_iterations, converged=converged, stalled=stalled,
+                        map_shape=map_shape)
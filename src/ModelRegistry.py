@@ -0,0 +1,25 @@
+import lmfit
+
+import MoreModels
+
+# the component types that can be added to a fit, {display name: factory taking the prefix}
+implemented_models = {
+    "Shirley background": lambda pref: lmfit.Model(MoreModels.calculate_shirley, prefix=pref,
+                                                    independent_vars=['x', 'y']),
+    "Voigt": lambda pref: lmfit.models.VoigtModel(prefix=pref),
+    "CasaLA": lambda pref: MoreModels.ConvGaussianSplitLorentz(prefix=pref),
+    "Voigt doublet": lambda pref: MoreModels.VoigtDoubletModel(prefix=pref),
+    "CasaLA doublet": lambda pref: MoreModels.ConvGaussianSplitLorentzDoublet(prefix=pref),
+}
+
+
+def make_model(kind, prefix) -> lmfit.Model:
+    """
+    :param kind: one of the keys of implemented_models
+    :param prefix: parameter prefix, which is also the component's name
+    """
+    try:
+        factory = implemented_models[kind]
+    except KeyError:
+        raise ValueError(f"Unknown component type {kind!r}, expected one of {', '.join(implemented_models)}")
+    return factory(prefix)
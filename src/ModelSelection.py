@@ -0,0 +1,149 @@
+import functools
+import operator
+from dataclasses import dataclass
+
+import lmfit
+import numpy as np
+
+import MoreModels
+import PeakGuessing
+
+
+@dataclass
+class ModelSelectionResult:
+    table: list  # one dict of fit statistics per candidate order
+    best_order: int
+    criterion: str
+    components: list  # lmfit.Models of the added components for the chosen order
+    best_values: dict  # fitted values of every parameter for the chosen order
+
+    def report(self):
+        lines = [f"{'n':>3} {'AIC':>12} {'BIC':>12} {'red. chi-sq':>12}"]
+        for row in self.table:
+            marker = " <" if row["n_components"] == self.best_order else ""
+            lines.append(f"{row['n_components']:>3} {row['aic']:>12.2f} {row['bic']:>12.2f} "
+                         f"{row['redchi']:>12.4g}{marker}")
+        return "\n".join(lines)
+
+
+def _fit_candidate(component_models, params, x, data, weights):
+    """
+    Fit one candidate order. Runs inside a worker process, so the composite model is rebuilt here and only the
+    result's summary is sent back, None if the fit failed.
+    """
+    fitting_model = functools.reduce(operator.add, component_models)
+    try:
+        result = fitting_model.fit(data, params, x=x, y=data, weights=weights)
+    except (ValueError, RuntimeError, TypeError):
+        # TypeError is what lmfit raises for a region with fewer points than the candidate has parameters
+        return None
+    return result.summary()
+
+
+def _statistics(summary):
+    if summary is None:
+        return {"aic": np.inf, "bic": np.inf, "chisqr": np.inf, "redchi": np.inf, "nvarys": 0, "success": False,
+                "best_values": {}}
+    return {"aic": summary["aic"], "bic": summary["bic"], "chisqr": summary["chisqr"], "redchi": summary["redchi"],
+            "nvarys": summary["nvarys"], "success": summary["success"], "best_values": dict(summary["best_values"])}
+
+
+def seed_components(x, data, model_factory, n_components, base_name="p", base_models=()):
+    """
+    Create n_components new components, each seeded from the largest feature left after subtracting the
+    base models and the previously seeded components (which are not fitted in between).
+
+    :returns: list of lmfit.Models and a matching list of lmfit.Parameters with their starting values
+    """
+    residuals = np.array(data, dtype=float)
+    if base_models:
+        base_model, base_params = MoreModels.build_fitting_model(list(base_models))
+        residuals -= base_model.eval(base_params, x=x, y=data)
+
+    components = []
+    params = []
+    for i in range(1, n_components + 1):
+        model = model_factory(f"{base_name}{i}")
+        component_params = model.make_params()
+        guess = PeakGuessing.best_guess(x, residuals)
+        seeds = PeakGuessing.seed_from_guess(model.prefix, component_params.keys(), guess, x, model)
+        for name, seed in seeds.items():
+            component_params[name].set(value=seed["value"], min=seed["min"], max=seed["max"])
+        residuals = residuals - model.eval(component_params, x=x, y=data)
+        components.append(model)
+        params.append(component_params)
+    return components, params
+
+
+def select_model_order(x, data, model_factory, max_components=5, base_name="p", base_models=(),
+                       criterion="bic", n_workers=None, mask=None, cache=None):
+    """
+    Work out how many components of one line shape the spectrum needs.
+
+    Up to max_components components are seeded one after the other from the largest remaining residual
+    feature (see seed_components), then the candidate models with 1..max_components of them (plus any
+    base_models, e.g. a background) are fitted in parallel and ranked by AIC or BIC. Candidates found in cache
+    aren't refitted, the others are stored in it.
+
+    :param model_factory: callable taking a prefix and returning an lmfit.Model, e.g. a value of
+        PeakSelector's implemented_models
+    :param base_models: Components included in every candidate
+    :param criterion: "aic" or "bic"
+    :param n_workers: number of worker processes, 1 fits everything in this process
+    :param mask: optional points to leave out of the fits, see MoreModels.fit_weights
+    :param cache: optional FitCache, shared with MoreModels.optimise_multiple_models
+    :returns: ModelSelectionResult
+    :raises ValueError: if the candidates' parameter names (base_name1, base_name2, ...) clash with base_models',
+        or if every candidate fit fails
+    """
+    if criterion not in ("aic", "bic"):
+        raise ValueError(f"Unknown criterion {criterion}, use \"aic\" or \"bic\"")
+    x = np.asarray(x, dtype=float)
+    data = np.asarray(data, dtype=float)
+    components, component_params = seed_components(x, data, model_factory, max_components, base_name, base_models)
+
+    base_components = []
+    base_params = lmfit.Parameters()
+    if base_models:
+        base_model, base_params = MoreModels.build_fitting_model(list(base_models))
+        base_components = list(base_model.components)
+        clashes = sorted(set(base_model.param_names) & {n for model in components for n in model.param_names})
+        if clashes:
+            raise ValueError(f"The base models already have parameters named {', '.join(clashes)}, choose another "
+                             f"base name than {base_name}")
+
+    candidates = []
+    for order in range(1, max_components + 1):
+        params = base_params.copy()
+        for seeded in component_params[:order]:
+            params.update(seeded)
+        candidates.append((base_components + components[:order], params))
+
+    weights = MoreModels.fit_weights(data, mask)
+    summaries = [None] * len(candidates)
+    if cache is not None:
+        keys = [cache.make_key(x, data, weights, functools.reduce(operator.add, models), params)
+                for models, params in candidates]
+        summaries = [cache.get_summary(key) for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+
+    executor = MoreModels.make_process_pool(n_workers, candidates) if len(missing) > 1 else None
+    if executor is None:
+        fitted = [_fit_candidate(*candidates[i], x, data, weights) for i in missing]
+    else:
+        with executor:
+            fitted = list(executor.map(_fit_candidate, *zip(*[candidates[i] for i in missing]),
+                                       [x] * len(missing), [data] * len(missing), [weights] * len(missing)))
+    for i, summary in zip(missing, fitted):
+        summaries[i] = summary
+        if cache is not None and summary is not None:
+            cache.put_summary(keys[i], summary)
+
+    results = [_statistics(summary) for summary in summaries]
+    best_values = [result.pop("best_values") for result in results]
+    table = [{"n_components": order, **result} for order, result in enumerate(results, start=1)]
+    if not np.any(np.isfinite([row[criterion] for row in table])):
+        raise ValueError(f"None of the candidate fits with 1 to {max_components} components succeeded")
+    best_index = int(np.argmin([row[criterion] for row in table]))
+    return ModelSelectionResult(table=table, best_order=best_index + 1, criterion=criterion,
+                                components=components[:best_index + 1], best_values=best_values[best_index])
@@ -1,15 +1,29 @@
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import time
+
 import numpy as np
-from lmfit.lineshapes import  gaussian, split_lorentzian
+from lmfit.lineshapes import  gaussian, split_lorentzian, tiny
 from lmfitxps.lineshapes import fft_convolve
 from lmfitxps import backgrounds
 from lmfit import Model
 import lmfit
 from lmfit.models import guess_from_peak
+from scipy.signal import fftconvolve
+from scipy.special import wofz
 
-from CustomWidgets import PeakDataModel
 
+def optimise_multiple_models(x, data, models, cache=None, coarse_factor=None, mask=None):
+    """
+    Fit the sum of models to data. If a FitCache is passed, an identical earlier fit is returned from the
+    cache instead of being rerun. With coarse_factor the fit is first run on the spectrum rebinned by that
+    factor and then refined on the full grid, see fit_coarse_to_fine.
 
-def optimise_multiple_models(x, data, models):
+    :param mask: optional boolean array, points where it is False are left out of the fit (see fit_weights)
+    :raises ValueError: if the fit region doesn't have more points than there are varying parameters
+    """
     assert isinstance(models, list)
 
     if not (any(x) and any(data)):
@@ -19,6 +33,48 @@ def optimise_multiple_models(x, data, models):
     if not any(models):
         raise  ValueError("Need a list containing at least one model")
 
+    fitting_model, parameters = build_fitting_model(models)
+    n_points = len(x) if mask is None else int(np.count_nonzero(mask))
+    n_varying = sum(p.vary and p.expr is None for p in parameters.values())
+    if n_points <= n_varying:
+        raise ValueError(f"The fit region has {n_points} points, it needs more than the {n_varying} varying "
+                         f"parameters")
+    weights = fit_weights(data, mask)
+    fit_options = {"coarse_factor": coarse_factor} if coarse_factor else {}
+    if cache is not None:
+        key = cache.make_key(x, data, weights, fitting_model, parameters, **fit_options)
+        result = cache.get(key, fitting_model, x, data, weights, y=data)
+        if result is not None:
+            return result
+
+    if coarse_factor:
+        result = fit_coarse_to_fine(fitting_model, parameters, x, data, coarse_factor, mask)
+    else:
+        result = fitting_model.fit(data, parameters, x=x, y=data, weights=weights)
+
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+def fit_weights(data, mask=None):
+    """
+    1 / sqrt(data), the weights of the fits, zero where mask is False. Points left out of a fit that way stay on
+    the grid, which line shapes convolved with FFTs need to be evenly spaced, without counting towards chi-square.
+    """
+    with np.errstate(divide='ignore'):
+        weights = 1 / np.sqrt(data)
+    if mask is None:
+        return weights
+    return np.where(mask, weights, 0.0)
+
+
+def build_fitting_model(models):
+    """
+    Sum the lmfit models of a list of Components (or PeakDataModels) into one composite model.
+
+    :returns: the composite model and an lmfit.Parameters holding the current values of every component
+    """
     fitting_model, parameters = models[0].get_model_and_params_for_fitting()
     for i in range(1, len(models)):
         temp_data_model = models[i]
@@ -26,7 +82,142 @@ def optimise_multiple_models(x, data, models):
         temp_model, parameters = temp_data_model.get_model_and_params_for_fitting(parameters)
         fitting_model += temp_model
 
-    return fitting_model.fit(data, parameters, x=x, y=data, weights=1 / (np.sqrt(data)))
+    return fitting_model, parameters
+
+
+def make_process_pool(n_workers, *payload):
+    """
+    A process pool for fitting in parallel, or None if n_workers is 1 or the payload can't be sent to worker
+    processes (e.g. lmfit's ConstantModel defines its function inside __init__, so can't be pickled).
+
+    :param n_workers: number of processes, None for one per CPU
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    if n_workers <= 1:
+        return None
+    try:
+        pickle.dumps(payload)
+    except (AttributeError, TypeError, pickle.PicklingError):
+        return None
+    # spawn rather than fork, forking a process that is running Qt isn't safe
+    return concurrent.futures.ProcessPoolExecutor(max_workers=n_workers,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+
+
+def full_parameters(fitting_model, parameters):
+    """
+    All parameters of fitting_model, including those only defined through expression hints (e.g. a Voigt's
+    gamma), with the values and bounds taken from parameters where it has them.
+    """
+    full = fitting_model.make_params()
+    for name, par in parameters.items():
+        full[name].set(value=par.value, min=par.min, max=par.max, vary=par.vary)
+    return full
+
+
+def function_arguments(model):
+    """
+    Names (with prefix) of the parameters model.func takes. Parameters that only exist as hints, derived from the
+    others by an expression (e.g. a Voigt's fwhm and height), aren't passed to it.
+    """
+    return [model.prefix + arg for arg in model._func_allargs if arg not in model.independent_vars]
+
+
+def rebin_spectrum(x, data, factor):
+    """
+    Average every factor neighbouring points into one, the last bin taking whatever is left over.
+
+    Intensities stay per channel, so the integrated counts (and so peak areas) of the rebinned spectrum match
+    the original.
+
+    :returns: rebinned x, rebinned data, and the number of points in each bin
+    """
+    starts = np.arange(0, len(x), factor)
+    counts = np.diff(np.append(starts, len(x)))
+    return np.add.reduceat(x, starts) / counts, np.add.reduceat(data, starts) / counts, counts
+
+
+def fit_coarse_to_fine(fitting_model, parameters, x, data, factor=4, mask=None):
+    """
+    Fit the rebinned spectrum first, then use the result as the starting point for the fit on the full grid,
+    where only a few iterations should be needed. The time and function evaluations spent on each stage
+    are stored in result.multi_resolution.
+
+    Convolution kernel widths (gaussian_sigma) are kept at or above the coarse grid's step during the coarse
+    stage, narrower kernels sample to nothing there. If the coarse fit fails anyway, the full grid is fitted
+    directly from parameters and the error is stored as result.multi_resolution["coarse_error"].
+
+    :param mask: optional points to leave out, as for fit_weights. Coarse bins containing any of them are left out
+    """
+    x = np.asarray(x, dtype=float)
+    data = np.asarray(data, dtype=float)
+    n_varying = sum(p.vary and p.expr is None for p in parameters.values())
+
+    coarse_time = 0.0
+    coarse_nfev = 0
+    coarse_error = None
+    start_params = parameters
+    if len(x) // factor > n_varying:
+        start = time.perf_counter()
+        x_coarse, data_coarse, counts = rebin_spectrum(x, data, factor)
+        # the mean of n points has 1/n the variance of one point
+        coarse_weights = np.sqrt(counts / data_coarse)
+        if mask is not None:
+            _, selected, _ = rebin_spectrum(x, np.asarray(mask, dtype=float), factor)
+            coarse_weights = np.where(selected == 1, coarse_weights, 0.0)
+        coarse_params = coarse_kernel_bounds(parameters, np.min(np.abs(np.diff(x_coarse))))
+        try:
+            coarse_result = fitting_model.fit(data_coarse, coarse_params, x=x_coarse, y=data_coarse,
+                                              weights=coarse_weights)
+            start_params = coarse_result.params.copy()
+            # back to the caller's bounds for the fit on the full grid
+            for name, par in parameters.items():
+                if par.expr is None:
+                    start_params[name].set(min=par.min, max=par.max)
+            coarse_nfev = coarse_result.nfev
+        except (ValueError, ArithmeticError) as e:
+            # e.g. lmfit refusing NaN from the model, fall back to a direct fit
+            coarse_error = str(e)
+        coarse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = fitting_model.fit(data, start_params, x=x, y=data, weights=fit_weights(data, mask))
+    result.multi_resolution = {"factor": factor, "coarse_time": coarse_time, "coarse_nfev": coarse_nfev,
+                               "fine_time": time.perf_counter() - start, "fine_nfev": result.nfev,
+                               "coarse_error": coarse_error}
+    return result
+
+
+def coarse_kernel_bounds(parameters, step):
+    """
+    A copy of parameters with the lower bound of every varying gaussian_sigma raised to step.
+    """
+    params = parameters.copy()
+    for name, par in params.items():
+        if name.endswith("gaussian_sigma") and par.vary and par.expr is None and par.min < step:
+            par.set(min=step, max=max(par.max, 2 * step), value=max(par.value, step))
+    return params
+
+
+def benchmark_multi_resolution(x, data, models, factor=4, mask=None):
+    """
+    Time a coarse to fine fit against a direct fit on the full grid, both from the same starting parameters.
+
+    :returns: dict with the timings, the function evaluations on the full grid and the speedup
+    """
+    fitting_model, parameters = build_fitting_model(models)
+    start = time.perf_counter()
+    direct = fitting_model.fit(data, parameters, x=x, y=data, weights=fit_weights(data, mask))
+    direct_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    multi = fit_coarse_to_fine(fitting_model, parameters, x, data, factor, mask)
+    multi_time = time.perf_counter() - start
+
+    return {"direct_time": direct_time, "direct_nfev": direct.nfev, "direct_chisqr": direct.chisqr,
+            "multi_resolution_time": multi_time, "multi_resolution_fine_nfev": multi.nfev,
+            "multi_resolution_chisqr": multi.chisqr, "speedup": direct_time / multi_time}
 
 
 def split_lorentz_conv_gauss(x,
@@ -119,6 +310,135 @@ class ConvGaussianSplitLorentz(lmfit.model.Model):
         return lmfit.models.update_param_vals(params, self.prefix, **kwargs)
 
 
+def split_lorentz_conv_gauss_doublet(x,
+                                    amplitude: float,
+                                    center: float,
+                                    sigma: float,
+                                    sigma_r: float,
+                                    gaussian_sigma: float,
+                                    splitting: float,
+                                    area_ratio: float) -> np.ndarray:
+    """
+    Two split_lorentz_conv_gauss lines of the same shape, the second at center + splitting with area_ratio times
+    the intensity of the first. Both lines are convolved in one call, sharing the FFT of the Gaussian kernel, with
+    the same padding as lmfitxps' fft_convolve.
+    """
+    is_binding_energy = x[-1] < x[0]
+    lines = np.stack((split_lorentzian(x, amplitude=1, center=center, sigma=sigma, sigma_r=sigma_r),
+                      split_lorentzian(x, amplitude=1, center=center + splitting, sigma=sigma, sigma_r=sigma_r)))
+    kernel = 1 / (np.sqrt(2 * np.pi) * gaussian_sigma) * gaussian(x, amplitude=1, center=np.mean(x),
+                                                                  sigma=gaussian_sigma)
+    if is_binding_energy:
+        kernel = kernel[::-1]
+    n = len(x)
+    padded = np.concatenate((np.repeat(lines[:, :1], n, axis=1), lines, np.repeat(lines[:, -1:], n, axis=1)), axis=1)
+    out = fftconvolve(padded, kernel[np.newaxis, :], mode='valid', axes=1)
+    start = int((out.shape[1] - n) / 2)
+    conv = out[:, start:start + n]
+    conv = conv / np.max(conv, axis=1, keepdims=True)
+    return amplitude * (conv[0] + area_ratio * conv[1])
+
+
+class ConvGaussianSplitLorentzDoublet(lmfit.model.Model):
+    __doc__ = ("""
+       A spin-orbit doublet of ConvGaussianSplitLorentz lines (CasaXPS LA), evaluated in a single pass.
+       Both lines share their widths, the second is shifted by splitting and scaled by area_ratio.
+
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | Parameters     |  Type         | Description                                                                            |
+        +================+===============+========================================================================================+
+        | x              | :obj:`array`  | 1D-array containing the x-values (energies) of the spectrum.                           |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | amplitude      | :obj:`float`  | amplitude :math:`A` of the first line                                                  |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | center         | :obj:`float`  | Center of the first line.                                                              |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | sigma          | :obj:`float`  | Width of Lorentzian to left of centre                                                  |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | sigma_r        | :obj:`float`  | Width of Lorentzian to right of centre                                                 |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | gaussian_sigma | :obj:`float`  | Width of the gaussian convolution kernel                                               |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | splitting      | :obj:`float`  | Center of the second line minus the center of the first                                |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | area_ratio     | :obj:`float`  | Intensity of the second line relative to the first, e.g. 0.5 for p, 2/3 for d levels   |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+
+       **LMFIT: Common models documentation**
+    """"""""""""""""""""""""""""""""""""
+
+    """ + lmfit.models.COMMON_INIT_DOC)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(split_lorentz_conv_gauss_doublet, *args, **kwargs)
+        self._set_paramhints_prefix()
+
+    def _set_paramhints_prefix(self):
+        self.set_param_hint('amplitude', value=100, min=0)
+        self.set_param_hint('sigma', value=0.2, min=0)
+        self.set_param_hint('sigma_r', value=0.02)
+        self.set_param_hint('gaussian_sigma', value=0.2, min=0)
+        self.set_param_hint('center', value=100, min=0)
+        self.set_param_hint('splitting', value=1)
+        self.set_param_hint('area_ratio', value=0.5, min=0)
+        g_fwhm_expr = '2*{pre:s}gaussian_sigma*1.17741'
+        self.set_param_hint('gaussian_fwhm', expr=g_fwhm_expr.format(pre=self.prefix))
+
+
+def voigt_doublet(x, amplitude=1.0, center=0.0, sigma=1.0, gamma=None, splitting=1.0, area_ratio=0.5):
+    """
+    Two lmfit voigt lines of the same shape, the second at center + splitting with area_ratio times the area of
+    the first, from a single call of the Faddeeva function on both lines.
+    """
+    if gamma is None:
+        gamma = sigma
+    sigma = max(tiny, sigma)
+    centers = np.array([[center], [center + splitting]])
+    lines = np.real(wofz((x - centers + 1j * gamma) / (sigma * np.sqrt(2))))
+    return amplitude * (lines[0] + area_ratio * lines[1]) / (sigma * np.sqrt(2 * np.pi))
+
+
+class VoigtDoubletModel(lmfit.model.Model):
+    __doc__ = ("""
+       A spin-orbit doublet of Voigt lines (as lmfit's VoigtModel), evaluated in a single pass.
+       Both lines share their widths, the second is shifted by splitting and scaled by area_ratio.
+
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | Parameters     |  Type         | Description                                                                            |
+        +================+===============+========================================================================================+
+        | x              | :obj:`array`  | 1D-array containing the x-values (energies) of the spectrum.                           |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | amplitude      | :obj:`float`  | Area of the first line                                                                 |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | center         | :obj:`float`  | Center of the first line.                                                              |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | sigma          | :obj:`float`  | Gaussian width, the Lorentzian width gamma follows it unless set free                  |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | splitting      | :obj:`float`  | Center of the second line minus the center of the first                                |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+        | area_ratio     | :obj:`float`  | Area of the second line relative to the first, e.g. 0.5 for p, 2/3 for d levels        |
+        +----------------+---------------+----------------------------------------------------------------------------------------+
+
+       **LMFIT: Common models documentation**
+    """"""""""""""""""""""""""""""""""""
+
+    """ + lmfit.models.COMMON_INIT_DOC)
+
+    def __init__(self, *args, **kwargs):
+        # gamma defaults to None, which lmfit would otherwise take for an independent variable
+        kwargs.setdefault('independent_vars', ['x'])
+        super().__init__(voigt_doublet, *args, **kwargs)
+        self._set_paramhints_prefix()
+
+    def _set_paramhints_prefix(self):
+        self.set_param_hint('sigma', min=0)
+        self.set_param_hint('gamma', expr=f'{self.prefix}sigma')
+        self.set_param_hint('splitting', value=1)
+        self.set_param_hint('area_ratio', value=0.5, min=0)
+        fwhm_expr = "1.0692*{pre:s}gamma+sqrt(0.8664*{pre:s}gamma**2+5.545083*{pre:s}sigma**2)"
+        self.set_param_hint('fwhm', expr=fwhm_expr.format(pre=self.prefix))
+
+
 def calculate_shirley(x, y, avg_width = 1, offset_low = 0.0, offset_high = 0.0) -> np.ndarray:
     if avg_width >= len(y):
         avg_width = len(y) // 3  # fallback if too large (//=floordiv)
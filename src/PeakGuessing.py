@@ -1,49 +1,332 @@
-import numpy
-import scipy.signal as signal
+import copy
+import math
+import warnings
+
 import numpy as np
 import scipy.signal as signal
-import matplotlib.pyplot as plt
-import math
+
+
+def _half_max_widths(y, peaks):
+    # reference level of half the absolute peak height, with the whole spectrum as the search range
+    heights = y[peaks]
+    prominence_data = (np.maximum(heights, 0),
+                       np.zeros(len(peaks), dtype=np.intp),
+                       np.full(len(peaks), len(y) - 1, dtype=np.intp))
+    with warnings.catch_warnings():
+        # zero height peaks warn about their prominence, their widths are still fine
+        warnings.simplefilter("ignore", RuntimeWarning)
+        _, _, left_ips, right_ips = signal.peak_widths(y, peaks, rel_height=0.5, prominence_data=prominence_data)
+    return heights, left_ips, right_ips
+
+
+def _crossings(x, left_ips, right_ips):
+    # x at the interpolated sample positions, returned as (lower x, higher x) whichever way x runs
+    sample = np.arange(x.size)
+    left_x = np.interp(left_ips, sample, x)
+    right_x = np.interp(right_ips, sample, x)
+    if x[-1] < x[0]:
+        return right_x, left_x
+    return left_x, right_x
+
+
+def peak_descriptors(x: np.ndarray, y: np.ndarray, peaks=None):
+    """
+    Height, half maximum crossings and left/right widths of many peaks at once.
+
+    The crossings are where y first drops to half the peak height walking out from the peak, linearly
+    interpolated between samples (or the ends of the spectrum if it never does). y can be a single spectrum or
+    a 2-D stack with one spectrum per row sharing x. Left and right are towards lower and higher x, also when x
+    runs downwards (binding energy scales), and the widths are distances, so never negative.
+
+    :param peaks: indices of the peaks, or for a stack a list with one array of indices per row.
+        Defaults to everything signal.find_peaks returns.
+    :returns: dict of arrays with one entry per peak: "row", "index", "position", "height", "left_x",
+        "right_x", "width_left", "width_right" and "fwhm"
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    stack = np.atleast_2d(y)
+    if peaks is None:
+        peaks = [signal.find_peaks(row)[0] for row in stack]
+    elif y.ndim == 1:
+        peaks = [peaks]
+
+    rows, indices, heights, left_ips, right_ips = [], [], [], [], []
+    for row, (spectrum, row_peaks) in enumerate(zip(stack, peaks)):
+        row_peaks = np.asarray(row_peaks, dtype=np.intp)
+        if row_peaks.size == 0:
+            continue
+        row_heights, row_left, row_right = _half_max_widths(spectrum, row_peaks)
+        rows.append(np.full(row_peaks.size, row))
+        indices.append(row_peaks)
+        heights.append(row_heights)
+        left_ips.append(row_left)
+        right_ips.append(row_right)
+
+    if len(indices) == 0:
+        empty = np.array([])
+        return {k: empty for k in ("row", "index", "position", "height", "left_x", "right_x", "width_left",
+                                   "width_right", "fwhm")}
+
+    indices = np.concatenate(indices)
+    position = x[indices]
+    left_x, right_x = _crossings(x, np.concatenate(left_ips), np.concatenate(right_ips))
+    return {
+        "row": np.concatenate(rows),
+        "index": indices,
+        "position": position,
+        "height": np.concatenate(heights),
+        "left_x": left_x,
+        "right_x": right_x,
+        "width_left": np.abs(position - left_x),
+        "width_right": np.abs(right_x - position),
+        "fwhm": np.abs(right_x - left_x),
+    }
 
 
 def calculate_fwhm(x, y, peak_index: int):
-    peak_value = y[peak_index]
-    half_peak_value = peak_value / 2
+    descriptors = peak_descriptors(x, y, [peak_index])
+    return descriptors["fwhm"][0], descriptors["left_x"][0], descriptors["right_x"][0]
 
-    # Find the closest point to the left of peak_index where y <= half_peak_value
-    left_index = peak_index
-    while left_index > 0 and y[left_index] > half_peak_value:
-        left_index -= 1
 
-    # Find the closest point to the right of peak_index where y <= half_peak_value
-    right_index = peak_index
-    while right_index < len(y) - 1 and y[right_index] > half_peak_value:
-        right_index += 1
+def poisson_noise_floor(y: np.ndarray):
+    """
+    Poisson noise of counts at the background level, sqrt of the median. At very low counts the median is 0, then
+    the level follows from the fraction of channels with no counts, P(0) = exp(-level). Works along the last axis.
+    """
+    y = np.asarray(y, dtype=float)
+    level = np.median(y, axis=-1)
+    zeros = np.mean(y == 0, axis=-1)
+    with np.errstate(divide='ignore'):
+        from_zeros = np.where(zeros > 0, -np.log(zeros), 0.0)
+    return np.sqrt(np.where(level > 0, level, from_zeros))
 
-    # Get the x values corresponding to these points
-    left_x = x[left_index]
-    right_x = x[right_index]
 
-    # FWHM is the difference between the right and left x values
-    fwhm = right_x - left_x
-    return fwhm, left_x, right_x
+def estimate_noise(y: np.ndarray):
+    """
+    Standard deviation of the point to point noise, from the median absolute deviation of the first
+    differences so that the peaks themselves barely contribute. Works along the last axis.
 
+    On low count spectra most differences are 0, so the MAD is too, and it is raised to poisson_noise_floor.
+    """
+    diffs = np.diff(y, axis=-1)
+    mad = np.median(np.abs(diffs - np.median(diffs, axis=-1, keepdims=True)), axis=-1)
+    return np.maximum(mad / (0.6745 * math.sqrt(2)), poisson_noise_floor(y))
 
-def best_guess(x: np.ndarray, y: np.ndarray, window_size=None):
+
+def smoothing_window(y: np.ndarray):
+    """
+    Widest Savitzky-Golay window (cubic) that still only removes noise from y.
+
+    While the window is narrower than the features, what it takes away from y is noise, and neighbouring
+    points of that are anti-correlated. Once it starts cutting into the peaks the removed part picks up their
+    shape and becomes positively correlated, so the window grows until that happens.
+
+    :returns: the window length, or None if even the narrowest window cuts into the features
+    """
+    best = None
+    window = 5
+    while window <= max(len(y) // 10, 5) and window < len(y):
+        removed = y - signal.savgol_filter(y, window, 3)
+        if np.sum(removed[1:] * removed[:-1]) > 0:
+            break
+        best = window
+        window = max(window + 2, int(window * 1.2) | 1)
+    return best
+
+
+def smooth_spectrum(y: np.ndarray, window_size=None):
+    """
+    Savitzky-Golay smoothing with the widest window that still only removes noise (see smoothing_window).
+    """
+    if window_size is None:
+        window_size = smoothing_window(y)
+        if window_size is None:
+            return y.copy()
+    window_size = max(window_size | 1, 5)
+    return signal.savgol_filter(y, window_size, 3) if window_size < len(y) else y.copy()
+
+
+def find_shoulders(x: np.ndarray, y: np.ndarray, min_depth=8.0, window_size=None, min_prominence=3.0):
+    """
+    Components hidden in the flank of a larger peak, found from minima of the second derivative.
+
+    A shoulder that never becomes a maximum of its own still bends the spectrum, so the Savitzky-Golay second
+    derivative has a local minimum there. Minima whose prominence is at least min_depth times the noise on the
+    second derivative are kept, unless a peak of the smoothed spectrum lies within their half width (those are
+    ordinary peaks). Prominence runs from trough to crest, so on flat Poisson spectra of 150 to 2000 points the
+    deepest minimum of pure noise has a median depth of 4.5-5.7 and stays below 8 in 99% of spectra, hence the
+    default. The last half window at either end is left out, the filter extrapolates a polynomial there. The
+    filtering is done for all rows of a stack at once. The noise is estimate_noise, floored at the Poisson noise
+    of the background and at the float resolution of y, so noise free spectra don't turn up rounding errors.
+
+    :param window_size: Savitzky-Golay window, defaults to smoothing_window of the (mean) spectrum
+    :param min_prominence: prominence, in units of the noise, a peak of the smoothed spectrum needs to count as a
+        peak rather than a shoulder, as in ranked_guesses
+    :returns: dict of arrays with one entry per shoulder, sorted by row and then deepest first: "row", "index",
+        "position", "height", "width_left", "width_right" and "depth" (prominence in units of the noise)
+    """
+    keys = ("row", "index", "position", "height", "width_left", "width_right", "depth")
+    x = np.asarray(x, dtype=float)
+    stack = np.atleast_2d(np.asarray(y, dtype=float))
+    n = x.size
+    if window_size is None:
+        window_size = smoothing_window(np.mean(stack, axis=0)) or 5
+    window_size = max(window_size | 1, 5)
+    if n < window_size + 2:
+        return {k: np.array([]) for k in keys}
+
+    delta = (x[-1] - x[0]) / (n - 1)
+    smoothed = signal.savgol_filter(stack, window_size, 3, axis=-1)
+    second = signal.savgol_filter(stack, window_size, 3, deriv=2, delta=delta, axis=-1)
+    # the filter is linear, so the noise on the second derivative is the noise on y times the norm of its taps.
+    # Noise free data (or data that isn't counts, where the Poisson floor doesn't apply) still has rounding
+    # errors, so the noise is taken as at least the resolution of a float at the scale of y
+    resolution = np.sqrt(np.finfo(float).eps) * np.max(np.abs(stack), axis=-1)
+    noise = np.maximum(estimate_noise(stack), resolution)
+    second_noise = noise * np.linalg.norm(signal.savgol_coeffs(window_size, 3, deriv=2, delta=abs(delta)))
+
+    found = {k: [] for k in ("row", "index", "depth", "left_ips", "right_ips")}
+    half = window_size // 2
+    tiny = np.finfo(float).tiny
+    for row in range(stack.shape[0]):
+        # the filter extrapolates a polynomial over the last half window at either end, which bends on its own,
+        # so minima are only searched for (and their prominences measured) between those
+        minima, props = signal.find_peaks(-second[row, half:n - half],
+                                          prominence=max(min_depth * second_noise[row], tiny), width=0, rel_height=0.5)
+        if minima.size == 0:
+            continue
+        minima = minima + half
+        props["left_ips"] = props["left_ips"] + half
+        props["right_ips"] = props["right_ips"] + half
+        # only peaks that ranked_guesses would report count, a bump barely above the noise is a shoulder
+        peaks, _ = signal.find_peaks(smoothed[row], prominence=max(min_prominence * noise[row], tiny))
+        covers_peak = np.any((peaks[np.newaxis, :] >= props["left_ips"][:, np.newaxis])
+                             & (peaks[np.newaxis, :] <= props["right_ips"][:, np.newaxis]), axis=1)
+        keep = ~covers_peak
+        found["row"].append(np.full(np.count_nonzero(keep), row))
+        found["index"].append(minima[keep])
+        found["depth"].append(props["prominences"][keep] / second_noise[row])
+        found["left_ips"].append(props["left_ips"][keep])
+        found["right_ips"].append(props["right_ips"][keep])
+
+    if len(found["index"]) == 0:
+        return {k: np.array([]) for k in keys}
+    rows = np.concatenate(found["row"])
+    indices = np.concatenate(found["index"])
+    depth = np.concatenate(found["depth"])
+    position = x[indices]
+    left_x, right_x = _crossings(x, np.concatenate(found["left_ips"]), np.concatenate(found["right_ips"]))
+    # for a Gaussian, the half prominence width of the second derivative minimum is 0.79 sigma either side,
+    # against 1.18 sigma for the half width at half maximum of the peak itself
+    scale = 1.49
+    order = np.lexsort((-depth, rows))
+    return {
+        "row": rows[order],
+        "index": indices[order],
+        "position": position[order],
+        "height": smoothed[rows, indices][order],
+        "width_left": (scale * np.abs(position - left_x))[order],
+        "width_right": (scale * np.abs(right_x - position))[order],
+        "depth": depth[order],
+    }
+
+
+def ranked_guesses(x: np.ndarray, y: np.ndarray, k=1, min_prominence=3.0, window_size=None,
+                   include_shoulders=True):
+    """
+    Starting guesses for the k tallest peaks of the smoothed spectrum.
+
+    Peaks are only counted if their prominence is at least min_prominence times the estimated noise, so noise
+    spikes on the raw data don't get picked up. Heights and widths are measured on the smoothed spectrum.
+    With include_shoulders, shoulders found by find_shoulders fill the list after the peaks, deepest first.
+
+    :returns: list of at most k (height, position, left width, right width) tuples, tallest first
+    """
     if window_size is None:
-        window_size = math.floor(min(len(y) / 50, 5))
-    y_smoothed = np.convolve(y, np.ones(window_size) / window_size, mode='same')
-    peaks = signal.find_peaks(y)[0]
-
-    largest_amplitude = 0
-    biggest_peak_pos = 0
-    biggest_peak_fwhm_left = 0
-    biggest_peak_fwhm_right = 0
-    for peak_index in peaks:
-        _, left_x, right_x = calculate_fwhm(x, y, peak_index)
-        if y[peak_index] > largest_amplitude:
-            largest_amplitude = y[peak_index]
-            biggest_peak_pos = x[peak_index]
-            biggest_peak_fwhm_left = x[peak_index] - left_x
-            biggest_peak_fwhm_right = right_x - x[peak_index]
-    return largest_amplitude, biggest_peak_pos, biggest_peak_fwhm_left, biggest_peak_fwhm_right
+        window_size = smoothing_window(y)
+    noise = estimate_noise(y)
+    y_smoothed = smooth_spectrum(y, window_size)
+    peaks, _ = signal.find_peaks(y_smoothed, prominence=max(min_prominence * noise, np.finfo(float).tiny))
+    descriptors = peak_descriptors(x, y_smoothed, peaks)
+
+    order = np.argsort(descriptors["height"])[::-1][:k]
+    guesses = [(descriptors["height"][i], descriptors["position"][i],
+                descriptors["width_left"][i], descriptors["width_right"][i])
+               for i in order if descriptors["height"][i] > 0]
+
+    if include_shoulders and len(guesses) < k:
+        shoulders = find_shoulders(x, y, window_size=window_size, min_prominence=min_prominence)
+        for i in range(shoulders["index"].size):
+            if len(guesses) >= k:
+                break
+            if shoulders["height"][i] > 0:
+                guesses.append((shoulders["height"][i], shoulders["position"][i],
+                                shoulders["width_left"][i], shoulders["width_right"][i]))
+    return guesses
+
+
+def best_guess(x: np.ndarray, y: np.ndarray, window_size=None):
+    guesses = ranked_guesses(x, y, k=1, window_size=window_size)
+    if len(guesses) == 0:
+        return 0, 0, 0, 0
+    return guesses[0]
+
+
+def _match_peak_shape(model, prefix, seeds, guess):
+    # scale the widths of the seeds until the model's own FWHM is the guessed one, then the amplitude until its
+    # maximum is the guessed height. Evaluated on a fine grid around the guess so narrow peaks are resolved
+    height, pos, w_left, w_right = guess
+    # make_params adds the hint parameters (fwhm, height) to a model's param_names, which the component
+    # making its parameters from them can't fit with, so a copy is used
+    params = copy.deepcopy(model).make_params()
+    for name, seed in seeds.items():
+        params[name].set(value=seed["value"])
+    widths = [prefix + n for n in ("sigma", "sigma_r", "gaussian_sigma")
+              if prefix + n in params and params[prefix + n].expr is None]
+    half_range = 10 * max(w_left, w_right)
+    grid = np.linspace(pos - half_range, pos + half_range, 4001)
+    for _ in range(3):
+        curve = model.eval(params, x=grid)
+        fwhm = calculate_fwhm(grid, curve, int(np.argmax(curve)))[0]
+        if not (np.isfinite(fwhm) and fwhm > 0):
+            return
+        for name in widths:
+            params[name].set(value=params[name].value * (w_left + w_right) / fwhm)
+    peak = np.max(model.eval(params, x=grid))
+    if not (np.isfinite(peak) and peak > 0):
+        return
+    width_max = 2 * max(params[name].value for name in widths) if widths else None
+    for name in widths:
+        seeds[name] = {"value": params[name].value, "min": 0, "max": width_max}
+    amplitude = params[prefix + "amplitude"].value * height / peak
+    seeds[prefix + "amplitude"] = {"value": amplitude, "min": 0, "max": amplitude * 2}
+
+
+def seed_from_guess(prefix, param_names, guess, x, model=None):
+    """
+    Starting values and limits for a new component from a best_guess style (height, position, left width,
+    right width) tuple, as slider dicts ({'value', 'min', 'max'}) keyed by parameter name.
+
+    Without model the amplitude is the height and the widths are the half widths at half maximum. Given the
+    component's lmfit.Model, the widths are scaled so the model's FWHM matches the guess and the amplitude so its
+    maximum is the height; for most line shapes (Voigt, ...) the amplitude is an area and sigma isn't the HWHM.
+    """
+    height, pos, w_left, w_right = guess
+    seeds = {}
+    if height <= 0:
+        return seeds
+    width_max = max(w_left, w_right) * 2
+    candidates = {
+        "amplitude": {"value": height, "min": 0, "max": height * 2},
+        "sigma": {"value": w_left, "min": 0, "max": width_max},
+        "sigma_r": {"value": w_right, "min": 0, "max": width_max},
+        "center": {"value": pos, "min": np.min(x), "max": np.max(x)},
+    }
+    for name, seed in candidates.items():
+        if prefix + name in param_names:
+            seeds[prefix + name] = seed
+    if (model is not None and prefix + "amplitude" in seeds and w_left + w_right > 0
+            and set(model.independent_vars) == {"x"}):
+        _match_peak_shape(model, prefix, seeds, guess)
+    return {name: seed for name, seed in seeds.items() if name in param_names}
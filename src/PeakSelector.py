@@ -2,20 +2,27 @@ import sys
 
 from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtWidgets import QApplication, QMainWindow, QDialog, QVBoxLayout, QPushButton, QLabel, QLineEdit, QWidget, \
-    QFormLayout, QComboBox
-import lmfit
+    QFormLayout, QComboBox, QSpinBox
 
-import MoreModels
+import ModelRegistry
 
 
 class PeakSelector(QDialog):
     # Define a signal to send data back to the main window
     data_signal = pyqtSignal(object)
+    # several peaks of the same type at once, named <name>1, <name>2, ...
+    models_signal = pyqtSignal(list)
 
-    def __init__(self, existing_names):
+    def __init__(self, existing_names, auto_select=False):
+        """
+        :param auto_select: choose the peak type, base name and maximum number of components for
+            ModelSelection.select_model_order instead of adding peaks. Nothing is emitted, the candidates are
+            named <name>1 to <name>N and all of those names are checked.
+        """
         super().__init__()
         self.setWindowTitle("PeakSelector")
         self.existing_names = existing_names
+        self.auto_select = auto_select
 
         # Set up the layout and widgets for the popup
         self.layout = QFormLayout()
@@ -26,16 +33,23 @@ class PeakSelector(QDialog):
         self.name_label = QLabel(text="Choose a unique name")
         self.layout.addRow(self.name_label, self.name_field)
 
-        self.implemented_models = {"Shirley background": lambda pref: lmfit.Model(MoreModels.calculate_shirley,prefix=pref, independent_vars=['x','y']),
-                                    "Voigt": lambda pref: lmfit.models.VoigtModel(prefix=pref),
-                                   "CasaLA": lambda pref: MoreModels.ConvGaussianSplitLorentz(prefix=pref)
-                                   }
+        self.implemented_models = ModelRegistry.implemented_models
         self.combobox = QComboBox()
         self.combobox.addItems(self.implemented_models.keys())
         self.combobox_label = QLabel(text="Peak type")
         self.layout.addRow(self.combobox_label, self.combobox)
 
-        self.ok_button = QPushButton("Add Peak", self)
+        self.count_spinbox = QSpinBox()
+        self.count_spinbox.setRange(1, 15)
+        self.count_label = QLabel(text="Number of peaks")
+        if auto_select:
+            self.setWindowTitle("Auto Select Components")
+            self.count_spinbox.setValue(4)
+            self.count_label.setText("Maximum number of components")
+        self.count_spinbox.valueChanged.connect(self.check_name)
+        self.layout.addRow(self.count_label, self.count_spinbox)
+
+        self.ok_button = QPushButton("Select Components" if auto_select else "Add Peak", self)
         self.ok_button.clicked.connect(self.on_ok_clicked)
         self.ok_button.setEnabled(False)
         self.layout.addWidget(self.ok_button)
@@ -69,7 +83,8 @@ class PeakSelector(QDialog):
         """
 
         new_name = self.name_field.text()
-        if (new_name in self.existing_names) or (new_name == "") or (new_name is None):
+        if (new_name in self.existing_names) or (new_name == "") or (new_name is None) or \
+                any(name in self.existing_names for name in self.peak_names(new_name)):
             self.ok_button.setEnabled(False)
             self.name_field.setStyleSheet(error_style)
         else:
@@ -77,10 +92,23 @@ class PeakSelector(QDialog):
             self.curr_name = new_name
             self.name_field.setStyleSheet(default_style)
 
+    def peak_names(self, name):
+        count = self.count_spinbox.value()
+        if count == 1 and not self.auto_select:
+            return [name]
+        return [f"{name}{i}" for i in range(1, count + 1)]
+
     def on_ok_clicked(self):
+        if self.auto_select:
+            self.accept()
+            return
         peak_type = self.combobox.currentText()
         model = self.implemented_models[peak_type]
-        self.data_signal.emit(model(self.curr_name))  # Emit the signal with the data
+        names = self.peak_names(self.curr_name)
+        if len(names) == 1:
+            self.data_signal.emit(model(self.curr_name))  # Emit the signal with the data
+        else:
+            self.models_signal.emit([model(name) for name in names])
         self.accept()  # Close the popup
 
 
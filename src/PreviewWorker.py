@@ -0,0 +1,152 @@
+import functools
+import threading
+import time
+
+import numpy as np
+from PyQt6.QtCore import QCoreApplication, QObject, QThread, pyqtSignal, pyqtSlot
+
+
+def stop_thread(thread):
+    thread.quit()
+    thread.wait()
+
+
+class _Worker(QObject):
+    finished = pyqtSignal(str, int, object, float)  # component name, request id, output (None if failed), seconds
+    dropped = pyqtSignal(int)  # request id, superseded before it was evaluated
+
+    def __init__(self):
+        super().__init__()
+        self._latest = {}  # {(component name, id of x): newest request id}
+        self._lock = threading.Lock()
+
+    def mark_latest(self, key, request_id):
+        # called from the GUI thread before the request is queued
+        with self._lock:
+            self._latest[key] = request_id
+
+    def _is_stale(self, key, request_id):
+        with self._lock:
+            return self._latest.get(key, request_id) != request_id
+
+    @pyqtSlot(str, int, object)
+    def evaluate(self, name, request_id, job):
+        model, params, x, kwargs = job
+        if self._is_stale((name, id(x)), request_id):
+            self.dropped.emit(request_id)
+            return
+        start = time.perf_counter()
+        try:
+            output = model.eval(params=params, x=x, **kwargs)
+        except Exception:
+            # e.g. parameters the line shape can't handle, the GUI thread evaluates it again and reports it
+            output = None
+        self.finished.emit(name, request_id, output, time.perf_counter() - start)
+
+
+class PreviewEvaluator(QObject):
+    """
+    Evaluates components for the plot, moving the slow ones off the GUI thread.
+
+    Components are evaluated in place until one evaluation takes longer than threshold seconds; after that
+    their evaluations are queued on a worker thread and evaluate returns None until the result is back. Only the
+    newest request per component and grid is evaluated, older ones still waiting when it arrives are dropped. Each
+    result is announced with ready and kept as the component's latest output, which evaluate returns while the
+    next one is pending, so a curve keeps following a slider that is being dragged. Results are only stored in
+    the component's evaluation cache if its parameters haven't moved on in the meantime.
+    """
+    ready = pyqtSignal(str)  # component name
+    _request = pyqtSignal(str, int, object)
+
+    def __init__(self, threshold=0.008, parent=None):
+        super().__init__(parent)
+        self.threshold = threshold
+        self.eval_times = {}  # {component name: seconds the last evaluation took}
+        self.dropped = 0
+        self._jobs = {}  # {request id: (data model, x, kwargs, parameter values)}
+        self._pending = {}  # {(component name, id of x): parameter values of the newest request}
+        self._latest = {}  # {(component name, id of x): (x, last completed output)}
+        self._next_id = 0
+
+        self._thread = QThread(self)
+        self._worker = _Worker()
+        self._worker.moveToThread(self._thread)
+        self._request.connect(self._worker.evaluate)
+        self._worker.finished.connect(self._on_finished)
+        self._worker.dropped.connect(self._on_dropped)
+        self._thread.start()
+        # the thread must be stopped before it is destroyed, also when the window is deleted without being closed.
+        # destroyed is emitted before the children (the thread) are deleted, the slot mustn't reference self
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+        self.destroyed.connect(functools.partial(stop_thread, self._thread))
+
+    def evaluate(self, data_model, x, **kwargs):
+        """
+        :returns: the component evaluated on x, or None while a background evaluation is pending
+        """
+        output = data_model.cached_evaluation(x, **kwargs)
+        if output is not None:
+            return output
+        name = data_model.get_name()
+        if self.eval_times.get(name, 0.0) < self.threshold:
+            start = time.perf_counter()
+            output = data_model.evaluate(x, **kwargs)
+            self.eval_times[name] = time.perf_counter() - start
+            return output
+
+        key = (name, id(x))
+        values = data_model.param_values()
+        if self._pending.get(key) != values:
+            self._next_id += 1
+            self._jobs[self._next_id] = (data_model, x, kwargs, values)
+            self._pending[key] = values
+            self._worker.mark_latest(key, self._next_id)
+            self._request.emit(name, self._next_id, (data_model.peak_model, data_model.make_model_parameters(), x,
+                                                     kwargs))
+        return self.latest(name, x)
+
+    def latest(self, name, x):
+        """
+        :returns: the last completed output of the component on x, possibly for older parameters, or None
+        """
+        latest = self._latest.get((name, id(x)))
+        if latest is None or latest[0] is not x:
+            return None
+        return latest[1]
+
+    def forget(self, name):
+        """
+        Drop the timing of a removed component, so a new one with the same name starts out in place.
+        """
+        self.eval_times.pop(name, None)
+        self._pending = {k: v for k, v in self._pending.items() if k[0] != name}
+        self._latest = {k: v for k, v in self._latest.items() if k[0] != name}
+
+    def _finish_request(self, name, x, values):
+        key = (name, id(x))
+        if self._pending.get(key) == values:
+            del self._pending[key]
+
+    def _on_dropped(self, request_id):
+        data_model, x, kwargs, values = self._jobs.pop(request_id)
+        self._finish_request(data_model.get_name(), x, values)
+        self.dropped += 1
+
+    def _on_finished(self, name, request_id, output, seconds):
+        data_model, x, kwargs, values = self._jobs.pop(request_id)
+        self._finish_request(name, x, values)
+        if output is None:
+            # failed in the worker, evaluate in place next time so the error surfaces normally
+            self.eval_times[name] = 0.0
+            self.ready.emit(name)
+            return
+        self.eval_times[name] = seconds
+        output = np.asarray(output)
+        output.setflags(write=False)
+        self._latest[(name, id(x))] = (x, output)
+        # cached only if the parameters are still the ones it was evaluated for, shown either way
+        data_model.store_evaluation(x, kwargs, values, output)
+        self.ready.emit(name)
+
+    def stop(self):
+        stop_thread(self._thread)
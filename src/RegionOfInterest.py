@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class RegionOfInterest:
+    """
+    Energy windows to fit in, and ranges to leave out of the fit.
+
+    With no windows every point is selected, otherwise only points inside at least one window. Points inside any
+    exclusion are always removed. Fits run on the stretch from the first to the last selected point (span), so
+    backgrounds such as Shirley take their endpoint averages from the edges of the selected region rather than
+    from the ends of the whole scan. Points inside that stretch which aren't selected stay on the grid with zero
+    weight, as line shapes convolved with FFTs (CasaLA) need evenly spaced points.
+    """
+
+    def __init__(self):
+        self.windows = []  # [(low, high)]
+        self.exclusions = []  # [(low, high)]
+
+    def __bool__(self):
+        return bool(self.windows) or bool(self.exclusions)
+
+    @staticmethod
+    def _ordered(low, high):
+        return (low, high) if low <= high else (high, low)
+
+    def add_window(self, low, high):
+        self.windows.append(self._ordered(low, high))
+
+    def add_exclusion(self, low, high):
+        self.exclusions.append(self._ordered(low, high))
+
+    def clear(self):
+        self.windows = []
+        self.exclusions = []
+
+    def mask(self, x: np.ndarray) -> np.ndarray:
+        if self.windows:
+            selected = np.zeros(x.shape, dtype=bool)
+            for low, high in self.windows:
+                selected |= (x >= low) & (x <= high)
+        else:
+            selected = np.ones(x.shape, dtype=bool)
+        for low, high in self.exclusions:
+            selected &= ~((x >= low) & (x <= high))
+        return selected
+
+    def span(self, x: np.ndarray) -> np.ndarray:
+        """
+        The contiguous points from the first to the last selected one.
+        """
+        selected = np.flatnonzero(self.mask(x))
+        span = np.zeros(x.shape, dtype=bool)
+        if selected.size:
+            span[selected[0]:selected[-1] + 1] = True
+        return span
+
+    def apply(self, x: np.ndarray, *arrays):
+        """
+        Crop x and any other arrays of the same length to the selected points.
+        """
+        selected = self.mask(x)
+        return (x[selected],) + tuple(a[selected] for a in arrays)
@@ -0,0 +1,82 @@
+import time
+
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal
+
+
+class RenderScheduler(QObject):
+    """
+    Coalesces parameter changes and redraws to at most one per frame.
+
+    Parameter changes are submitted with a key (e.g. (component, parameter)) and a callable that applies them;
+    only the latest callable per key is kept until the next frame, the ones it replaces are counted as dropped.
+    Components that need redrawing are marked with request_render. When the frame timer fires the pending
+    changes are applied (which may mark more components dirty), then render is called once with the names of
+    all dirty components.
+    """
+    rendered = pyqtSignal(dict)  # stats(), after every frame
+
+    def __init__(self, render, interval_ms=16, parent=None):
+        super().__init__(parent)
+        self.render = render
+        self._pending = {}  # {key: callable}
+        self._dirty = []  # component names in the order they were marked
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval_ms)
+        self._timer.timeout.connect(self.flush)
+
+        self.submitted = 0
+        self.dropped = 0
+        self.frames = 0
+        self.last_render_time = 0.0
+        self.total_render_time = 0.0
+
+    def _schedule(self):
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def submit(self, key, apply):
+        self.submitted += 1
+        if key in self._pending:
+            self.dropped += 1
+        self._pending[key] = apply
+        self._schedule()
+
+    def request_render(self, name):
+        if name not in self._dirty:
+            self._dirty.append(name)
+        self._schedule()
+
+    def discard(self, name):
+        """
+        Forget pending changes and redraws of a component that is being removed. Keys are matched on their first
+        element if they are tuples.
+        """
+        self._pending = {k: v for k, v in self._pending.items()
+                         if (k[0] if isinstance(k, tuple) else k) != name}
+        if name in self._dirty:
+            self._dirty.remove(name)
+
+    def flush(self):
+        self._timer.stop()
+        pending, self._pending = self._pending, {}
+        for apply in pending.values():
+            apply()
+        dirty, self._dirty = self._dirty, []
+        if not dirty:
+            return
+
+        start = time.perf_counter()
+        self.render(dirty)
+        self.last_render_time = time.perf_counter() - start
+        self.total_render_time += self.last_render_time
+        self.frames += 1
+        if not self._pending and not self._dirty:
+            # rendering marked nothing new, no need for the frame the applied changes scheduled
+            self._timer.stop()
+        self.rendered.emit(self.stats())
+
+    def stats(self):
+        return {"submitted": self.submitted, "dropped": self.dropped, "frames": self.frames,
+                "last_render_time": self.last_render_time,
+                "mean_render_time": self.total_render_time / self.frames if self.frames else 0.0}
@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import time
+
+# modules that must not be imported before the main window is shown, they are loaded on first use or by the
+# background preload in XPyS.py
+DEFERRED_MODULES = ("lmfit", "lmfitxps", "scipy", "matplotlib.pyplot")
+
+# the fitting core, usable in scripts and worker processes without Qt
+CORE_MODULES = ("Components", "ModelRegistry", "DataImport", "RegionOfInterest", "MoreModels", "FitCache", "PeakGuessing",
+                "MapFitting", "GlobalFitting", "Bootstrap", "ModelSelection", "Workspace")
+
+# seconds from starting the interpreter to the main window being shown
+COLD_START_BUDGET = 1.5
+
+_SHOW_WINDOW = """
+import sys
+from PyQt6.QtWidgets import QApplication
+from GuiLayout import PeakFitter
+app = QApplication(sys.argv)
+window = PeakFitter()
+window.show()
+app.processEvents()
+window.close()
+"""
+
+_SRC = os.path.dirname(os.path.abspath(__file__))
+
+
+def _run(args):
+    env = dict(os.environ, PYTHONPATH=_SRC + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    return subprocess.run([sys.executable, *args], cwd=_SRC, env=env, capture_output=True, text=True, check=True)
+
+
+def import_times(module="GuiLayout"):
+    """
+    Imports made by a fresh interpreter importing module, parsed from the output of python -X importtime.
+
+    :returns: {module name: cumulative import time in seconds}
+    """
+    output = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative) * 1e-6
+        except ValueError:
+            # the header line
+            continue
+    return times
+
+
+def eager_imports(module="GuiLayout", deferred=DEFERRED_MODULES):
+    """
+    :returns: the deferred modules (or their submodules) that importing module pulls in
+    """
+    return sorted(name for name in import_times(module)
+                  if any(name == d or name.startswith(d + ".") for d in deferred))
+
+
+def qt_imports(modules=CORE_MODULES):
+    """
+    :returns: the PyQt6 modules pulled in by importing modules, which should be none for the core
+    """
+    return sorted(name for name in import_times("; import ".join(modules)) if name.split(".")[0] == "PyQt6")
+
+
+def cold_start_time(repeats=3):
+    """
+    Best of repeats wall clock times for a fresh interpreter to show the main window.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        _run(["-c", _SHOW_WINDOW])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check(budget=COLD_START_BUDGET):
+    """
+    Prints the results and returns whether startup imports none of the deferred modules and is within budget,
+    and the core imports no Qt.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    eager = eager_imports()
+    qt = qt_imports()
+    slowest = sorted(import_times().items(), key=lambda item: item[1], reverse=True)[:5]
+    seconds = cold_start_time()
+    print("slowest imports: " + ", ".join(f"{name} {t:.3f} s" for name, t in slowest))
+    print(f"imported before the window is shown: {', '.join(eager) if eager else 'none of the deferred modules'}")
+    print(f"cold start: {seconds:.3f} s (budget {budget:.3f} s)")
+    print(f"Qt imported by the core: {', '.join(qt) if qt else 'none'}")
+    return not eager and not qt and seconds <= budget
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check(float(sys.argv[1]) if len(sys.argv) > 1 else COLD_START_BUDGET) else 1)
@@ -0,0 +1,106 @@
+import copy
+import hashlib
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import RegionOfInterest
+
+
+class GridStore:
+    """
+    Energy grids shared between spectra. Grids with the same values are stored once, as one read only array.
+    """
+
+    def __init__(self):
+        self._grids = {}  # {digest: array}
+
+    def __len__(self):
+        return len(self._grids)
+
+    @staticmethod
+    def _digest(x):
+        return hashlib.sha256(x.tobytes()).hexdigest() + str(x.shape)
+
+    def intern(self, x) -> np.ndarray:
+        x = np.ascontiguousarray(x, dtype=float)
+        digest = self._digest(x)
+        shared = self._grids.get(digest)
+        if shared is None:
+            shared = x.copy()
+            shared.setflags(write=False)
+            self._grids[digest] = shared
+        return shared
+
+    def release_unused(self, in_use):
+        """
+        Forget grids that none of the arrays in in_use is.
+        """
+        used = {id(x) for x in in_use}
+        self._grids = {k: v for k, v in self._grids.items() if id(v) in used}
+
+    def nbytes(self):
+        return sum(x.nbytes for x in self._grids.values())
+
+
+@dataclass
+class ComponentState:
+    """
+    A component without any widgets: its lmfit model and the parameter values and limits.
+    """
+    model: object  # lmfit.Model
+    params: dict  # {name: BoundedValue}
+
+
+@dataclass
+class Spectrum:
+    name: str
+    x: np.ndarray  # shared with every other spectrum on the same grid
+    y: np.ndarray
+    roi: RegionOfInterest.RegionOfInterest = field(default_factory=RegionOfInterest.RegionOfInterest)
+    components: list = field(default_factory=list)  # ComponentStates
+
+
+class Workspace:
+    """
+    Any number of spectra and their fits. Only the spectrum being worked on has widgets; the rest are kept as
+    plain arrays and ComponentStates, with identical energy grids shared through a GridStore.
+    """
+
+    def __init__(self):
+        self.grids = GridStore()
+        self.spectra = []
+        self.active = None  # index into spectra
+
+    def __len__(self):
+        return len(self.spectra)
+
+    def add_spectrum(self, name, x, y):
+        x = self.grids.intern(x)
+        y = np.asarray(y, dtype=float)
+        if y.shape != x.shape:
+            raise ValueError(f"{name}: {y.size} counts for {x.size} energies")
+        self.spectra.append(Spectrum(name=name, x=x, y=y))
+        return len(self.spectra) - 1
+
+    def remove_spectrum(self, index):
+        del self.spectra[index]
+        if self.active is not None:
+            if self.active == index:
+                self.active = None
+            elif self.active > index:
+                self.active -= 1
+        self.grids.release_unused([s.x for s in self.spectra])
+
+    def active_spectrum(self):
+        return None if self.active is None else self.spectra[self.active]
+
+    @staticmethod
+    def snapshot(models):
+        """
+        ComponentStates of Components (or PeakDataModels), with copies of their parameters.
+        """
+        return [ComponentState(model=m.peak_model, params=copy.deepcopy(m.get_all_params())) for m in models]
+
+    def nbytes(self):
+        return self.grids.nbytes() + sum(s.y.nbytes for s in self.spectra)
@@ -1,14 +1,25 @@
+import importlib
 import sys
+import threading
 
 from PyQt6.QtWidgets import QApplication
 
-from GuiLayout import PeakFitter
+from GuiLayout import PeakFitter, PRELOAD_MODULES
+
+
+def preload(modules=PRELOAD_MODULES):
+    """
+    Import the fitting modules in the background, so they are ready by the time the user first needs them.
+    """
+    for name in modules:
+        importlib.import_module(name)
 
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = PeakFitter()
     window.show()
+    threading.Thread(target=preload, daemon=True).start()
     sys.exit(app.exec())
 
 
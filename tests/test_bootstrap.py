@@ -0,0 +1,54 @@
+import lmfit
+import numpy as np
+
+import Bootstrap
+import Components
+import FitCache
+import MoreModels
+
+
+def _gaussian_on_background():
+    x = np.linspace(280, 292, 150)
+    model = lmfit.models.GaussianModel()
+    truth = model.eval(model.make_params(amplitude=2000, center=286, sigma=0.8), x=x)
+    y = np.random.default_rng(0).poisson(50 + truth).astype(float)
+
+    peak = Components.Component(lmfit.models.GaussianModel(prefix="p_"))
+    peak.set_param("p_amplitude", Components.BoundedValue(1500, 0, 10000))
+    peak.set_param("p_center", Components.BoundedValue(285.8, 282, 290))
+    peak.set_param("p_sigma", Components.BoundedValue(1, 0.1, 5))
+    background = Components.Component(lmfit.models.ConstantModel(prefix="b_"))
+    background.set_param("b_c", Components.BoundedValue(40, 0, 200))
+    return x, y, [peak, background]
+
+
+def test_progress_can_cancel_between_batches():
+    x, y, models = _gaussian_on_background()
+    calls = []
+
+    def progress(attempted, n_samples):
+        calls.append((attempted, n_samples))
+        return len(calls) < 2
+
+    result = Bootstrap.bootstrap_uncertainties(x, y, models, n_samples=200, batch_size=10, n_workers=1, seed=0,
+                                               progress=progress)
+
+    assert calls == [(10, 200), (20, 200)]
+    assert result.cancelled and not result.converged
+    assert 0 < result.n_samples <= 20
+    assert "cancelled" in result.report()
+
+
+def test_refits_start_from_a_cached_best_fit(tmp_path):
+    x, y, models = _gaussian_on_background()
+    peak = models[:1]  # on its own, so the fitted model is the component's own
+    param_names = list(peak[0].peak_model.param_names)
+    cache = FitCache.FitCache(str(tmp_path))
+    MoreModels.optimise_multiple_models(x, y, peak, cache=cache)
+
+    result = Bootstrap.bootstrap_uncertainties(x, y, peak, n_samples=20, batch_size=10, n_workers=1, seed=0,
+                                               cache=cache)
+
+    assert cache.hits == 1
+    assert peak[0].peak_model.param_names == param_names
+    assert result.n_samples == 20
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import Constraints
+
+
+def test_apply_matches_lmfit_hint():
+    constraints = Constraints.ConstraintSet(["a", "s", "e", "h"], {
+        "h": "a * gamfcn(e)/max(1e-15, (gamfcn(0.5)*gamfcn(e-0.5)*s))"})
+    values = np.array([[100.0, 0.5, 1.5, 0.0], [50.0, 2.0, 2.0, 0.0]])
+
+    constraints.apply(values)
+
+    from scipy.special import gamma
+    expected = values[:, 0] * gamma(values[:, 2]) / (gamma(0.5) * gamma(values[:, 2] - 0.5) * values[:, 1])
+    assert np.allclose(values[:, 3], expected)
+
+
+def test_max_takes_any_number_of_arguments():
+    constraints = Constraints.ConstraintSet(["a", "b"], {"b": "max(a, 1, 2*a)"})
+    assert np.allclose(constraints.apply(np.array([[0.2, 0.0], [3.0, 0.0]]))[:, 1], [1, 6])
+
+
+@pytest.mark.parametrize("expression", ["a.__class__", "sqrt.__self__", "(lambda: 1)()", "[a for a in (1,)]",
+                                        "a[0]"])
+def test_rejects_syntax_beyond_arithmetic_and_calls(expression):
+    with pytest.raises(ValueError):
+        Constraints.ConstraintSet(["a", "b"], {"b": expression})
@@ -0,0 +1,40 @@
+import lmfit
+import numpy as np
+import pytest
+
+import FitCache
+
+
+def _line(x, slope=1.0):
+    return slope * x
+
+
+def _edited_line(x, slope=1.0):
+    return slope * x + 1
+
+
+def test_key_changes_when_the_line_shape_is_edited():
+    # same name and signature, as the function would have before and after an edit
+    _edited_line.__qualname__ = _line.__qualname__
+    x = np.linspace(0, 1, 11)
+    keys = []
+    for func in (_line, _edited_line):
+        model = lmfit.Model(func)
+        keys.append(FitCache.FitCache.make_key(x, x, None, model, model.make_params(slope=2)))
+
+    assert keys[0] != keys[1]
+
+
+def test_summary_round_trip(tmp_path):
+    cache = FitCache.FitCache(str(tmp_path))
+    x = np.linspace(0, 1, 11)
+    model = lmfit.Model(_line)
+    params = model.make_params(slope=1)
+    key = cache.make_key(x, 2 * x, None, model, params)
+    cache.put(key, model.fit(2 * x, params, x=x))
+
+    result = cache.get(key, model, x, 2 * x)
+
+    assert cache.hits == 1
+    assert result.params["slope"].value == pytest.approx(2)
+    assert np.allclose(result.best_fit, 2 * x)
@@ -0,0 +1,28 @@
+import lmfit
+import numpy as np
+import pytest
+
+import Components
+import GlobalFitting
+
+
+@pytest.mark.parametrize("model_class", [lmfit.models.VoigtModel, lmfit.models.Pearson7Model])
+def test_global_fit_peaks_with_derived_hints(model_class):
+    x = np.linspace(280, 292, 150)
+    rng = np.random.default_rng(1)
+    model = model_class(prefix="p_")
+    truth = model.eval(model.make_params(amplitude=2000, center=286, sigma=0.8), x=x)
+    spectra = [(x, rng.poisson(50 + truth * scale).astype(float)) for scale in (0.9, 1.0, 1.1)]
+    peak = Components.Component(model_class(prefix="p_"))
+    peak.set_param("p_amplitude", Components.BoundedValue(1500, 0, 10000))
+    peak.set_param("p_center", Components.BoundedValue(285.8, 282, 290))
+    peak.set_param("p_sigma", Components.BoundedValue(1, 0.1, 5))
+    background = Components.Component(lmfit.models.ConstantModel(prefix="b_"))
+    background.set_param("b_c", Components.BoundedValue(40, 0, 200))
+
+    result = GlobalFitting.global_fit(spectra, [peak, background])
+
+    assert result.success
+    for values in result.spectrum_values:
+        assert values["p_center"] == pytest.approx(286, abs=0.05)
+        assert np.isfinite(values["p_height"])
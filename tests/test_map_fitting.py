@@ -0,0 +1,60 @@
+import lmfit
+import numpy as np
+import pytest
+
+import Components
+import MapFitting
+import ModelRegistry
+import MoreModels
+
+
+def _components(kind):
+    peak = Components.Component(ModelRegistry.make_model(kind, "p"))
+    peak.set_param("pamplitude", Components.BoundedValue(3000, 0, 20000))
+    peak.set_param("pcenter", Components.BoundedValue(286.1, 282, 290))
+    if "pgaussian_sigma" in peak.get_all_params():
+        peak.set_param("pgaussian_sigma", Components.BoundedValue(0.4, 0.1, 2))
+    background = Components.Component(lmfit.models.ConstantModel(prefix="b"))
+    background.set_param("bc", Components.BoundedValue(40, 0, 200))
+    return [peak, background]
+
+
+def _map(kind, x, shape=(2, 2)):
+    rng = np.random.default_rng(0)
+    model = ModelRegistry.make_model(kind, "p")
+    params = model.make_params()
+    params["pamplitude"].set(value=2500)
+    params["pcenter"].set(value=286)
+    truth = model.eval(params, x=x)
+    scale = np.linspace(0.8, 1.2, int(np.prod(shape)))
+    return rng.poisson(50 + truth * scale[:, np.newaxis]).astype(float).reshape(*shape, x.size)
+
+
+@pytest.mark.parametrize("kind", ["Voigt", "Voigt doublet", "CasaLA", "CasaLA doublet"])
+def test_fit_map_peaks_with_derived_hints(kind):
+    x = np.linspace(280, 292, 150)
+
+    result = MapFitting.fit_map(x, _map(kind, x), _components(kind))
+
+    assert result.values.shape == (4, len(result.param_names))
+    assert np.all(np.isfinite(result.chisqr))
+    # the derived hints are filled in from the fitted parameters
+    hint = "pfwhm" if "pfwhm" in result.param_names else "pgaussian_fwhm"
+    assert np.all(np.isfinite(result.parameter_map(hint)))
+
+
+@pytest.mark.parametrize("kind", ["Voigt", "CasaLA"])
+def test_fit_map_matches_lmfit_per_pixel(kind):
+    x = np.linspace(280, 292, 150)
+    data = _map(kind, x)
+    components = _components(kind)
+
+    result = MapFitting.fit_map(x, data, components)
+
+    model, params = MoreModels.build_fitting_model(components)
+    for pixel, spectrum in enumerate(data.reshape(-1, x.size)):
+        expected = model.fit(spectrum, MoreModels.full_parameters(model, params), x=x,
+                             weights=1 / np.sqrt(np.clip(spectrum, 1, None)))
+        fitted = dict(zip(result.param_names, result.values[pixel]))
+        assert fitted["pcenter"] == pytest.approx(expected.params["pcenter"].value, abs=1e-3)
+        assert result.chisqr[pixel] == pytest.approx(expected.chisqr, rel=1e-3)
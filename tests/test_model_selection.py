@@ -0,0 +1,61 @@
+import lmfit
+import numpy as np
+import pytest
+
+import Components
+import FitCache
+import ModelRegistry
+import ModelSelection
+
+
+def _two_voigts():
+    x = np.linspace(280, 295, 301)
+    model = lmfit.models.VoigtModel()
+    truth = (model.eval(model.make_params(amplitude=3000, center=285, sigma=0.5), x=x)
+             + model.eval(model.make_params(amplitude=2000, center=288, sigma=0.5), x=x))
+    return x, np.random.default_rng(0).poisson(100 + truth).astype(float)
+
+
+def _voigt(prefix):
+    return ModelRegistry.make_model("Voigt", prefix)
+
+
+def test_seeds_land_on_separate_peaks():
+    x, y = _two_voigts()
+
+    _, params = ModelSelection.seed_components(x, y, _voigt, 2)
+
+    centers = sorted(p[f"p{i}center"].value for i, p in enumerate(params, start=1))
+    assert centers == pytest.approx([285, 288], abs=0.1)
+
+
+def test_picks_the_number_of_peaks():
+    x, y = _two_voigts()
+    background = Components.Component(lmfit.models.ConstantModel(prefix="b"))
+    background.set_param("bc", Components.BoundedValue(100, 0, 500))
+
+    selection = ModelSelection.select_model_order(x, y, _voigt, 3, base_models=[background], n_workers=1)
+
+    assert selection.best_order == 2
+
+
+def test_cached_candidates_are_not_refitted(tmp_path):
+    x, y = _two_voigts()
+    cache = FitCache.FitCache(str(tmp_path))
+
+    first = ModelSelection.select_model_order(x, y, _voigt, 3, n_workers=1, cache=cache)
+    second = ModelSelection.select_model_order(x, y, _voigt, 3, n_workers=1, cache=cache)
+
+    assert (cache.misses, cache.hits) == (3, 3)
+    assert second.table == first.table
+    assert second.best_values == pytest.approx(first.best_values)
+
+
+def test_raises_when_every_candidate_fails():
+    x = np.linspace(280, 295, 301)
+    y = np.zeros_like(x)
+    y[100] = -5
+    y[150] = 50
+
+    with pytest.raises(ValueError):
+        ModelSelection.select_model_order(x, y, _voigt, 2, n_workers=1)
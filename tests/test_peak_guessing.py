@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+import PeakGuessing
+
+
+def test_low_count_spectrum_has_one_peak():
+    x = np.linspace(280, 295, 601)
+    y = np.random.default_rng(0).poisson(0.2 + 30 * np.exp(-(x - 290) ** 2 / (2 * 0.4 ** 2))).astype(float)
+
+    assert PeakGuessing.estimate_noise(y) > 0
+    guesses = PeakGuessing.ranked_guesses(x, y, k=5)
+    assert len(guesses) == 1
+    assert guesses[0][1] == pytest.approx(290, abs=0.1)
+
+
+def test_descending_x_gives_the_same_guesses():
+    x = np.linspace(280, 295, 600)
+    y = np.random.default_rng(0).poisson(100 + 3000 * np.exp(-(x - 285) ** 2 / 0.72)).astype(float)
+
+    assert PeakGuessing.ranked_guesses(x[::-1], y[::-1]) == PeakGuessing.ranked_guesses(x, y)
+
+
+@pytest.mark.parametrize("y", [lambda x: 2 * x + 5, lambda x: 5 - 2 * x,
+                               lambda x: np.round(1000 * np.exp(-(x - 287) ** 2 / 2))])
+def test_noise_free_spectra_have_no_shoulders(y):
+    x = np.linspace(280, 295, 601)
+
+    assert PeakGuessing.find_shoulders(x, y(x))["index"].size == 0
+
+
+def test_flat_poisson_spectra_have_no_shoulders():
+    x = np.linspace(280, 295, 600)
+    flat = np.random.default_rng(5).poisson(20, (40, x.size)).astype(float)
+
+    assert PeakGuessing.find_shoulders(x, flat)["index"].size <= 1
+
+
+def test_seeding_leaves_the_model_alone():
+    import lmfit
+
+    x = np.linspace(280, 295, 301)
+    model = lmfit.models.GaussianModel(prefix="g")
+    names = list(model.param_names)
+
+    seeds = PeakGuessing.seed_from_guess("g", names, (1000, 285, 0.6, 0.6), x, model)
+
+    assert model.param_names == names
+    curve = model.eval(x=x, **{n.removeprefix("g"): seed["value"] for n, seed in seeds.items()})
+    assert curve.max() == pytest.approx(1000, rel=0.01)
@@ -0,0 +1,51 @@
+import lmfit
+import numpy as np
+import pytest
+
+import Components
+import MoreModels
+import RegionOfInterest
+
+
+def test_span_keeps_the_grid_between_selected_points():
+    x = np.linspace(280, 295, 16)
+    roi = RegionOfInterest.RegionOfInterest()
+    roi.add_window(282, 292)
+    roi.add_exclusion(285, 288)
+
+    span = roi.span(x)
+    mask = roi.mask(x)
+
+    assert np.array_equal(np.flatnonzero(span), np.arange(2, 13))
+    assert not np.any(mask[~span])
+    assert np.count_nonzero(span & ~mask) == 4
+
+
+def test_excluded_points_dont_change_a_convolved_fit():
+    x = np.linspace(280, 295, 301)
+    model = MoreModels.ConvGaussianSplitLorentz(prefix="c")
+    truth = model.eval(model.make_params(amplitude=3000, center=285, sigma=0.5, sigma_r=0.5, gaussian_sigma=0.5), x=x)
+    # a peak that isn't part of the model, inside the excluded range
+    y = np.random.default_rng(0).poisson(100 + truth + 2000 * np.exp(-(x - 288) ** 2 / 0.5)).astype(float)
+    mask = ~((x >= 286.5) & (x <= 290))
+    peak = Components.Component(MoreModels.ConvGaussianSplitLorentz(prefix="c"))
+    for name, limits in dict(camplitude=(2500, 0, 10000), ccenter=(285.3, 283, 287), csigma=(0.4, 0.01, 2),
+                             csigma_r=(0.4, 0.01, 2), cgaussian_sigma=(0.4, 0.05, 2)).items():
+        peak.set_param(name, Components.BoundedValue(*limits))
+    background = Components.Component(lmfit.models.ConstantModel(prefix="b"))
+    background.set_param("bc", Components.BoundedValue(80, 0, 500))
+
+    result = MoreModels.optimise_multiple_models(x, y, [peak, background], mask=mask)
+
+    assert result.params["ccenter"].value == pytest.approx(285, abs=0.02)
+    assert result.params["camplitude"].value == pytest.approx(3000, rel=0.02)
+
+
+def test_too_few_points_for_the_parameters():
+    x = np.linspace(280, 295, 301)
+    peak = Components.Component(lmfit.models.GaussianModel(prefix="g"))
+    mask = np.zeros(x.shape, dtype=bool)
+    mask[:3] = True
+
+    with pytest.raises(ValueError):
+        MoreModels.optimise_multiple_models(x, np.full(x.shape, 100.0), [peak], mask=mask)